@@ -0,0 +1,142 @@
+"""End to end benchmark of the library against the local mock X1 (gira.mock).
+
+    python benchmarks/bench_e2e.py [--iterations 50] [--latency 0] [--error-rate 0] [--concurrency 16]
+
+Reports the throughput and latency of authenticate, get_device_config, get_all, put_uid and the ingestion of
+callback events. The mock answers from GiraDocumentation/exmaple_config.json over https, --latency adds a delay in
+milliseconds to every request to approach a remote (VPN) device. For the requests the mock runs in a separate
+process, so it does not compete with the client threads for the GIL.
+"""
+
+import sys, os, time, asyncio, argparse, tempfile, logging, multiprocessing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from gira.cache import CacheObject
+from gira.device import GiraServer
+from gira.aio import AsyncGiraServer
+from gira.callback import CallbackServer
+from gira.mock import MockGiraServer
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'GiraDocumentation', 'exmaple_config.json')
+
+
+def measure(name, iterations, operation):
+    durations = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        try:
+            if not operation(i):
+                errors += 1
+        except Exception:
+            errors += 1
+        durations.append(time.perf_counter() - t)
+    report(name, iterations, time.perf_counter() - start, durations, errors)
+
+
+def report(name, operations, total, durations, errors=0):
+    durations = sorted(durations)
+    p50 = durations[len(durations) // 2] * 1000
+    p99 = durations[min(int(len(durations) * 0.99), len(durations) - 1)] * 1000
+    print(f'{name:<28} {operations:>8} {operations / total:>10.1f}/s {p50:>9.2f} ms {p99:>9.2f} ms {errors:>6}')
+
+
+def run_mock(connection, latency, error_rate):
+    with MockGiraServer(EXAMPLE_CONFIG, latency=latency, error_rate=error_rate) as mock:
+        connection.send(mock.hostname)
+        connection.recv()
+
+
+def bench_sync(hostname, args, directory):
+    cache = CacheObject(dburi=f'sqlite:///{directory}/sync.db', instance='bench')
+    server = GiraServer(hostname, 'admin', 'admin', cache, pool_maxsize=args.concurrency)
+
+    measure('authenticate', args.iterations, lambda i: server.authenticate(refresh=True))
+    measure('get_device_config refresh', args.iterations, lambda i: server.get_device_config(refresh=True))
+    measure('get_device_config cached', args.iterations, lambda i: server.get_device_config())
+
+    config = server.get_device_config()
+    functions = len(config.function_uids)
+    for concurrency in (1, args.concurrency):
+        # the first run opens the connections of the pool
+        config.get_all(concurrency=concurrency)
+        durations = []
+        for i in range(max(args.iterations // 10, 1)):
+            t = time.perf_counter()
+            config.get_all(concurrency=concurrency)
+            durations.append(time.perf_counter() - t)
+        report(f'get_all x{concurrency} (functions)', functions * len(durations), sum(durations),
+               [d / functions for d in durations])
+
+    uids = [dp.uid for dp in config.dataPiont_uids.values() if dp.canWrite][:args.iterations]
+    measure('put_uid', len(uids), lambda i: server.put_uid(uids[i], str(i)))
+
+    server.close()
+
+
+async def bench_callbacks(mock, args, directory):
+    cache = CacheObject(dburi=f'sqlite:///{directory}/async.db', instance='bench-async')
+    receiver = CallbackServer(queue_size=100000)
+
+    async with AsyncGiraServer(mock.hostname, 'admin', 'admin', cache) as server:
+        config = await server.get_device_config()
+        receiver.add(config)
+        await receiver.start(host='127.0.0.1', port=args.callback_port)
+        await server.set_callaback(f'http://127.0.0.1:{args.callback_port}/giraapi/function',
+                                   f'http://127.0.0.1:{args.callback_port}/giraapi/value', testCallbacks=False)
+
+        uids = list(config.dataPiont_uids)
+        batch = 100
+        durations = []
+        start = time.perf_counter()
+        for i in range(args.iterations):
+            events = [{'uid': uids[(i * batch + j) % len(uids)], 'value': str(i)} for j in range(batch)]
+            t = time.perf_counter()
+            await mock.send_events(events)
+            durations.append(time.perf_counter() - t)
+            while not receiver.queue.empty():
+                receiver.queue.get_nowait()
+        total = time.perf_counter() - start
+
+        report(f'callback events (x{batch})', args.iterations * batch, total, [d / batch for d in durations],
+               receiver.batches_refused)
+        await receiver.stop()
+
+
+async def bench_async(args, directory):
+    mock = MockGiraServer(EXAMPLE_CONFIG, latency=_latency(args), error_rate=args.error_rate)
+    await mock.start()
+    await bench_callbacks(mock, args, directory)
+    await mock.stop()
+
+
+def _latency(args):
+    return(args.latency / 1000 if args.latency else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0, help='delay of every request in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of the requests answered with an error')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--callback-port', type=int, default=5099)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    print(f'{"benchmark":<28} {"ops":>8} {"throughput":>12} {"p50":>12} {"p99":>12} {"errors":>6}')
+    with tempfile.TemporaryDirectory() as directory:
+        (connection, child) = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_mock, args=(child, _latency(args), args.error_rate), daemon=True)
+        process.start()
+        bench_sync(connection.recv(), args, directory)
+        connection.send('stop')
+        process.join()
+        asyncio.run(bench_async(args, directory))
+
+
+if __name__ == '__main__':
+    main()
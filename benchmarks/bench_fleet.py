@@ -0,0 +1,62 @@
+"""Compares fleet wide operations site by site and in parallel with gira.fleet.GiraFleet.
+
+    python benchmarks/bench_fleet.py [--sites 20] [--latency 100] [--workers 16] [--site-concurrency 4]
+
+All sites talk to one local mock X1 (gira.mock) with GiraDocumentation/exmaple_config.json that runs in a separate process, every site has its own cache
+instance and database file. --latency adds a delay in milliseconds to every request to approach remote devices.
+"""
+
+import sys, os, argparse, tempfile, logging, multiprocessing
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from gira.fleet import GiraFleet
+from gira.mock import MockGiraServer
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'GiraDocumentation', 'exmaple_config.json')
+
+
+def run_mock(connection, latency):
+    with MockGiraServer(EXAMPLE_CONFIG, latency=latency) as mock:
+        connection.send(mock.hostname)
+        connection.recv()
+
+
+def bench(name, hostname, args, directory, max_workers):
+    fleet = GiraFleet(max_workers=max_workers, site_concurrency=args.site_concurrency)
+    for i in range(args.sites):
+        fleet.add_site(f'{name}-{i:03}', hostname, 'admin', 'admin', dburi=f'sqlite:///{directory}/{name}-{i:03}.db')
+
+    for result in (fleet.connect(), fleet.refresh_config(refresh=True), fleet.get_all(),
+                   fleet.set_callbacks('https://127.0.0.1/{site}/function', 'https://127.0.0.1/{site}/value',
+                                       testCallbacks=False),
+                   fleet.delete_callbacks()):
+        print(f'{name:<10} {result.operation:<18} {len(result.ok):>4}/{len(result):<4} {result.duration:>8.2f} s '
+              f'{result.slowest.duration:>8.2f} s {result.total:>8.2f} s')
+    fleet.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sites', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=100, help='delay of every request in milliseconds')
+    parser.add_argument('--workers', type=int, default=16, help='sites handled at the same time')
+    parser.add_argument('--site-concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    print(f'{"mode":<10} {"operation":<18} {"ok":>9} {"duration":>10} {"slowest":>10} {"sum":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        (connection, child) = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_mock, args=(child, args.latency / 1000), daemon=True)
+        process.start()
+        hostname = connection.recv()
+        bench('serial', hostname, args, directory, 1)
+        bench('parallel', hostname, args, directory, args.workers)
+        connection.send('stop')
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Reports the cold start time of the library.
+
+    python benchmarks/bench_import.py [--runs 10]
+
+Every statement is timed in a fresh interpreter, the median of the runs is reported together with the heavy
+dependencies that were loaded by it. The eager row imports the dependencies that `import gira` used to load
+(requests, urllib3, lxml, asyncio and the sqlalchemy ORM) to compare against.
+"""
+
+import sys, os, json, argparse, statistics, subprocess
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+HEAVY = ('requests', 'urllib3', 'lxml', 'sqlalchemy', 'asyncio', 'aiohttp')
+
+STATEMENTS = [
+    ('import gira', 'import gira'),
+    ('from gira import GiraServer', 'from gira import GiraServer'),
+    ('first CacheObject', "from gira import CacheObject; CacheObject(dburi='sqlite://')"),
+    ('first GiraServer session', 'from gira.device import GiraServer; GiraServer._create_session(None, 1, 1, True, 0)'),
+    ('eager (previous import gira)',
+     'import requests, urllib3, lxml.etree, asyncio, sqlalchemy.ext.declarative, gira.cache, gira.device'),
+    ]
+
+CHILD = '''
+import sys, time, json
+start = time.perf_counter()
+{statement}
+duration = time.perf_counter() - start
+print(json.dumps([duration, sorted(m for m in {heavy!r} if m in sys.modules)]))
+'''
+
+
+def run(statement):
+    env = dict(os.environ, PYTHONPATH=SRC)
+    output = subprocess.run([sys.executable, '-c', CHILD.format(statement=statement, heavy=HEAVY)], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return(json.loads(output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"statement":<32} {"median":>10} {"min":>10}  loaded')
+    for (name, statement) in STATEMENTS:
+        results = [run(statement) for i in range(args.runs)]
+        durations = [duration for (duration, loaded) in results]
+        loaded = results[-1][1]
+        print(f'{name:<32} {statistics.median(durations) * 1000:>7.1f} ms {min(durations) * 1000:>7.1f} ms  '
+              f'{", ".join(loaded) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
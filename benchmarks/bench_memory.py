@@ -0,0 +1,139 @@
+"""Reports the memory footprint of the DeviceConfig object model of one site.
+
+    python benchmarks/bench_memory.py [uiconfig.json ...]
+
+Without arguments GiraDocumentation/exmaple_config.json is used. The retained memory is measured with tracemalloc
+after the configuration is parsed and the object graph is built, the raw json text is not counted. The baseline row
+builds the object model the library had before the configuration objects were slotted (plain objects with a
+__dict__, no interned strings and the parsed configuration kept in memory) to compare against.
+"""
+
+import sys, os, json, time, tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from gira.device import DeviceConfig
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'GiraDocumentation', 'exmaple_config.json')
+
+
+class BaselineDatapoint(object):
+    def __init__(self, dp):
+        self.value = None
+        self.function = None
+        self.location = None
+        for key in dp.keys():
+            setattr(self, key, dp[key])
+
+
+class BaselineFunction(object):
+    def __init__(self, config, device):
+        self.functionType = config['functionType']
+        self.channelType = config['channelType']
+        self.displayName = config['displayName']
+        self.uid = config['uid']
+        self.dp_uids = {}
+        self.location = None
+        self.dataPoints = []
+        for dp in config['dataPoints']:
+            datapoint = BaselineDatapoint(dp)
+            self.dataPoints.append(datapoint)
+            datapoint.function = self
+            self.dp_uids[datapoint.uid] = datapoint
+        self.trade = None
+        self.device = device
+
+
+class BaselineLocation(object):
+    def __init__(self, config, parent=None):
+        self.displayName = config['displayName']
+        self.locationType = config['locationType']
+        self.children = [BaselineLocation(location, self) for location in config.get('locations', ())]
+        self.functions = config.get('functions')
+        self.parent = parent
+        self.uids = {}
+
+
+class BaselineTrades(object):
+    def __init__(self, config):
+        self.uids = {}
+        self.tradeName = config['displayName']
+        self.tradeType = config['tradeType']
+
+
+class BaselineDeviceConfig(object):
+    '''DeviceConfig object model before the configuration objects were slotted'''
+
+    def __init__(self, device_config):
+        self.device_config = device_config
+        self.function_uids = {}
+        self.dataPiont_uids = {}
+        self.locations = []
+        self.trades = []
+
+        for config in device_config.get('functions', ()):
+            function = BaselineFunction(config, None)
+            self.function_uids[function.uid] = function
+            for dp in function.dataPoints:
+                self.dataPiont_uids[dp.uid] = dp
+
+        for config in device_config.get('locations', ()):
+            location = BaselineLocation(config)
+            self.locations.append(location)
+            stack = [location]
+            while stack:
+                location = stack.pop()
+                for uid in location.functions or ():
+                    function = self.function_uids[uid]
+                    function.location = location
+                    location.uids[uid] = function
+                stack.extend(location.children)
+
+        for config in device_config.get('trades', ()):
+            trade = BaselineTrades(config)
+            for uid in config.get('functions', ()):
+                function = self.function_uids[uid]
+                trade.uids[uid] = function
+                function.trade = trade
+            self.trades.append(trade)
+
+        self.uids = {}
+        self.uids.update(self.function_uids)
+        self.uids.update(self.dataPiont_uids)
+
+
+def footprint(build, text):
+    tracemalloc.start()
+    start = time.perf_counter()
+    config = build(json.loads(text))
+    duration = time.perf_counter() - start
+    (size, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return(config, size, peak, duration)
+
+
+def main(paths):
+    models = [('baseline', BaselineDeviceConfig),
+              ('slotted', lambda device_config: DeviceConfig(cache=None, device=None, device_config=device_config))]
+
+    for path in paths or [EXAMPLE_CONFIG]:
+        with open(path) as f:
+            text = f.read()
+
+        sizes = {}
+        for (name, build) in models:
+            (config, size, peak, duration) = footprint(build, text)
+            sizes[name] = size
+            if name == 'baseline':
+                print(f'{os.path.basename(path)}: {len(config.function_uids)} functions, '
+                      f'{len(config.dataPiont_uids)} datapoints, {len(config.locations)} locations, '
+                      f'{len(config.trades)} trades')
+            print(f'  {name:<9} retained {size / 1024:8.1f} KiB ({size / len(config.uids):5.0f} bytes per uid), '
+                  f'peak {peak / 1024:.1f} KiB, built in {duration * 1000:.1f} ms')
+            del config
+
+        print(f'  the slotted model retains {sizes["slotted"] / sizes["baseline"]:.0%} of the baseline')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
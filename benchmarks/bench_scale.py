@@ -0,0 +1,121 @@
+"""Reports how DeviceConfig scales with the size of the configuration.
+
+    python benchmarks/bench_scale.py [--sizes 1000,10000,100000] [--depth 4] [--fanout 6] [--trades 40]
+
+For every size (number of datapoints) a configuration is generated with gira.mock.generate_config. The construction
+time is split over the phases (functions, locations, trades and indexes), the retained memory is measured with
+tracemalloc in a separate run, and the cost of the common lookups and queries is timed on the result.
+"""
+
+import sys, os, time, json, random, argparse, tracemalloc, timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from gira.device import DeviceConfig
+from gira.mock import generate_config, FunctionTypes
+
+AVERAGE_DATAPOINTS = sum(len(names) for (channel_type, names, trade) in FunctionTypes.values()) / len(FunctionTypes)
+
+
+class TimedDeviceConfig(DeviceConfig):
+    '''DeviceConfig that records the duration of every construction phase'''
+
+    def __init__(self, *args, **kwargs):
+        self.phases = {}
+        super().__init__(*args, **kwargs)
+
+    def _timed(self, phase, method):
+        start = time.perf_counter()
+        method()
+        self.phases[phase] = time.perf_counter() - start
+
+    def _proc_functions(self):
+        self._timed('functions', super()._proc_functions)
+
+    def _proc_location(self):
+        self._timed('locations', super()._proc_location)
+
+    def _proc_trades(self):
+        self._timed('trades', super()._proc_trades)
+
+    def _build_indexes(self):
+        self._timed('indexes', super()._build_indexes)
+
+
+def per_call(statement, number):
+    return(min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e6)
+
+
+def bench(size, args):
+    config = generate_config(functions=max(int(size / AVERAGE_DATAPOINTS), 1), location_depth=args.depth,
+                             locations_per_level=args.fanout, trades=args.trades)
+    text = json.dumps(config)
+
+    raw = json.loads(text)
+    start = time.perf_counter()
+    device_config = TimedDeviceConfig(cache=None, device=None, device_config=raw)
+    total = time.perf_counter() - start
+
+    tracemalloc.start()
+    retained = DeviceConfig(cache=None, device=None, device_config=json.loads(text))
+    (memory, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retained
+
+    datapoints = len(device_config.dataPiont_uids)
+    print(f'{datapoints} datapoints, {len(device_config.function_uids)} functions, '
+          f'{len(device_config.location_ids)} locations, {len(device_config.trades)} trades, '
+          f'{len(text) / 1024 / 1024:.1f} MiB json')
+    print(f'  construction {total * 1000:9.1f} ms  ' +
+          '  '.join(f'{phase} {duration * 1000:.1f} ms' for (phase, duration) in device_config.phases.items()))
+    print(f'  memory       {memory / 1024 / 1024:9.1f} MiB  peak {peak / 1024 / 1024:.1f} MiB  '
+          f'{memory / datapoints:.0f} bytes per datapoint')
+
+    start = time.perf_counter()
+    snapshot = device_config.snapshot()
+    dumped = time.perf_counter() - start
+    start = time.perf_counter()
+    DeviceConfig.from_snapshot(snapshot, None, None)
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    DeviceConfig(cache=None, device=None, device_config=json.loads(text))
+    parsed = time.perf_counter() - start
+    print(f'  snapshot     {len(snapshot) / 1024 / 1024:9.1f} MiB  dump {dumped * 1000:.1f} ms  load {loaded * 1000:.1f} ms  '
+          f'(json.loads and construction {parsed * 1000:.1f} ms)')
+
+    rand = random.Random(1)
+    uids = rand.sample(list(device_config.uids), 100)
+    paths = list(device_config.location_ids_by_path)
+    top = paths[0]
+    leaf = device_config.location_ids[-1].path
+    trade = device_config.trades[0].tradeName if device_config.trades else None
+    n = iter(range(1 << 62))
+
+    lookups = [
+        ('uid()', lambda: device_config.uid(uids[next(n) % 100]), 10000),
+        ('location(path)', lambda: device_config.location(leaf), 10000),
+        ('select(functionType)', lambda: device_config.select(functionType='de.gira.schema.functions.KNX.Light'), 100),
+        ('select(name, trade)', lambda: device_config.select(name='Brightness', trade=trade), 100),
+        ('select(within=leaf)', lambda: device_config.select(within=leaf), 10000),
+        ('select(within=top)', lambda: device_config.select(within=top), 100),
+        ('select(name, within=top)', lambda: device_config.select(name='OnOff', within=top), 100),
+        ('functions_under(top)', lambda: device_config.functions_under(top), 100),
+        ]
+    for (name, statement, number) in lookups:
+        print(f'  {name:<26} {per_call(statement, number):10.2f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated numbers of datapoints')
+    parser.add_argument('--depth', type=int, default=4, help='levels of the location tree')
+    parser.add_argument('--fanout', type=int, default=6, help='child locations of every location')
+    parser.add_argument('--trades', type=int, default=40)
+    args = parser.parse_args()
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        bench(size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -45,5 +45,15 @@ A couple of features:
 
 '''
 
-from gira.cache import CacheObject
-from gira.device import GiraServer
\ No newline at end of file
+__all__ = ['CacheObject', 'GiraServer']
+
+
+def __getattr__(name):
+    # the modules are imported on first use, `import gira` itself does not load requests or sqlalchemy
+    if name == 'CacheObject':
+        from gira.cache import CacheObject
+        return(CacheObject)
+    if name == 'GiraServer':
+        from gira.device import GiraServer
+        return(GiraServer)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
\ No newline at end of file
@@ -0,0 +1,751 @@
+"""Module to interact with the X1 Rest API from asyncio applications.
+
+The :class:`AsyncGiraServer` mirrors :class:`gira.device.GiraServer` but all the network calls are coroutines that
+run on the event loop over a pooled aiohttp session. It returns the same :class:`gira.device.DeviceConfig` model,
+with an AsyncGiraServer as device the `get` and `set` methods of the Function and Datapoint objects return
+awaitables.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> import asyncio
+    >>> from gira import CacheObject
+    >>> from gira.aio import AsyncGiraServer
+    >>> async def main():
+    ...     cache = CacheObject(dburi="sqlite:////tmp/gira.db")
+    ...     async with AsyncGiraServer(hostname, username, password, cache) as server:
+    ...         await server.connect()
+    ...         config = await server.get_device_config()
+    ...         await config.get_all(concurrency=20)
+    ...         await config.uid('a002').set(1)
+    >>> asyncio.run(main())
+
+"""
+
+import logging
+import json
+import asyncio
+import uuid
+import socket
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlparse
+
+import aiohttp
+
+from gira.device import DeviceTypes, IdentityURl, Headers, _endpoint, _load_device_config, _parse_vpn_form, _store_device_config
+from gira.instrument import Instrumentation, RequestStart, RequestEnd
+
+log = logging.getLogger(__name__)
+
+
+class AsyncGiraServer(object):
+    '''
+    asyncio class to interact with the REST API. Unlike GiraServer the constructor does not do any network I/O,
+    call :meth:`AsyncGiraServer.connect` or any other coroutine to login.
+
+    :param hostname: Hostname of the X1 or Home server on the local LAN
+    :param username: Gira Server (X1 or Home server) username
+    :param password: Gira Server (X1 or Home server) password
+    :param cache: gira.cache.CacheObject object
+    :param cookie: Cookie DICT
+    :param vpn: url to your X1 link through the Gira S1 (see gira.device.GiraServer)
+    :param gira_username: username of the https://geraeteportal.gira.de/ portal
+    :param gira_password: pasword of the https://geraeteportal.gira.de/ portal
+    :param refresh: boolean if True it will delete the cached settings.
+    :param limit: maximum number of simultaneous connections of the session.
+    :param limit_per_host: maximum number of simultaneous connections to one host, 0 is unlimited.
+    :param timeout: total timeout in seconds for every request.
+    :param keep_alive: boolean if False every request closes its connection after it is done.
+    :param put_chunk_size: maximum number of values sent in one PUT request by :meth:`AsyncGiraServer.put_uids`.
+    :param instrumentation: gira.instrument.Instrumentation object (see gira.device.GiraServer).
+
+    Like GiraServer a refused (401 or 403) token is renewed once for all the concurrent requests that were refused,
+    and the requests are sent again.
+
+    The database work of the cache (writing the token and cookie, loading and storing the device configuration) 
+    runs in a worker thread so it does not block the event loop. Only the first read of a cached setting still 
+    queries the database on the loop, create the cache with preload=True to load them all at once up front.
+    '''
+
+    def __init__(self,
+                 hostname,
+                 username,
+                 password,
+                 cache,
+                 cookie=None,
+                 vpn=False,
+                 gira_username=None,
+                 gira_password=None,
+                 refresh=False,
+                 limit=100,
+                 limit_per_host=0,
+                 timeout=60,
+                 keep_alive=True,
+                 put_chunk_size=100,
+                 instrumentation=None):
+
+        log.debug(f'{__name__} started')
+
+        if (cache == None):
+            raise ValueError(f'cache cannot not be None')
+
+        if refresh:
+            cache.invalidate()
+
+        self.cache = cache
+
+        cache.set_ignore(['username','password', 'gira_username', 'gira_password', 'vpn'])
+
+        self.cache.hostname = hostname
+        self.cache.username = username
+        self.cache.password = password
+        self.cache.gira_username = gira_username
+        self.cache.gira_password = gira_password
+        self.functions = None
+
+        if (vpn):
+            self.cache.vpn = vpn
+
+        if cookie:
+            self.cache.cookie = cookie if isinstance(cookie, str) else json.dumps(cookie)
+
+        self.DEVICETYPE = self.DEVICEURLS = None
+
+        self.cache.name = f'de.python.{uuid.getnode()}.{socket.gethostname()}'
+        self.errors = []
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.keep_alive = keep_alive
+        self.put_chunk_size = put_chunk_size
+        self.http_session = None
+        self.cookies = json.loads(self.cache.cookie) if self.cache.cookie else None
+
+        self.token_valid = None
+        self.reauthentications = 0
+        self._auth_lock = asyncio.Lock()
+        self._vpn_refresher = None
+
+        self.instrumentation = instrumentation or Instrumentation()
+        if cache.instrumentation is None:
+            cache.instrumentation = self.instrumentation
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        '''
+        Closes the http session and all pooled connections and flushes pending cache writes.
+        '''
+        # the token state and _auth_lock are kept: other tasks can still hold the lock, and the cached token stays
+        # valid for the next session
+        if (self._vpn_refresher):
+            self._vpn_refresher.cancel()
+            self._vpn_refresher = None
+
+        if (self.http_session):
+            await self.http_session.close()
+            self.http_session = None
+            log.debug(f'http session closed')
+
+        self.cache.flush()
+
+    def _session(self):
+        '''
+        Returns the pooled http session, it is created on first use because it has to be bound to the running loop.
+        '''
+        if not self.http_session:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             force_close=not self.keep_alive,
+                                             ssl=False)
+            self.http_session = aiohttp.ClientSession(connector=connector,
+                                                      headers=Headers,
+                                                      timeout=self.timeout,
+                                                      cookie_jar=aiohttp.DummyCookieJar())
+        return(self.http_session)
+
+    def _attach_cookie(self):
+        self.cookies = json.loads(self.cache.cookie) if self.cache.cookie else None
+
+    def invalidate_cache(self):
+        '''
+        This will delete the cache items of database.
+        '''
+        if (self.cache):
+            self.cache.invalidate()
+
+    async def connect(self, refresh=False):
+        '''
+        Logs in to the VPN (when configured), fetches the identity and authenticates at the device (see
+        GiraServer.connect). Cached settings are used without a request.
+
+        :param refresh: boolean if True the cookie, identity and token are fetched from the server again.
+        :returns: Authentication Token or False
+        '''
+        async with self._auth_lock:
+            return(await self._connect(refresh))
+
+    async def _connect(self, refresh=False):
+        # the caller holds _auth_lock, an asyncio.Lock is not reentrant
+        if not await self.vpn_login(refresh=refresh):
+            return(False)
+
+        if not await self.identity(refresh=refresh):
+            return(False)
+
+        return(await self.authenticate(refresh=refresh))
+
+    async def _connected(self):
+        '''
+        Connects when the device urls or the token are still missing, concurrent operations wait for one connect.
+        '''
+        if (self.DEVICEURLS is not None and self.cache.token):
+            return(True)
+
+        async with self._auth_lock:
+            if (self.DEVICEURLS is not None and self.cache.token):
+                return(True)
+            return(bool(await self._connect()))
+
+    async def get_device_config(self, refresh=False):
+        '''
+        Retrieves the configuration from the server or from the cache (see GiraServer.get_device_config).
+
+        :param refresh: boolean if True it will ignore the cache in the database and fetch the configuration from the server and store it in the cache.
+            With 'auto' only the (cheap) configuration uid is fetched from the server, the full configuration is only 
+            downloaded when the uid differs from the version in the cache.
+        :returns: DeviceConfig object with configuration of the device or False if the fetching of the device configuration fails.
+        '''
+        if not await self._connected():
+            return(False)
+
+        device_config = None
+        cached_version = await asyncio.to_thread(self.cache.blob_version, 'device_config')
+        
+        if (refresh == 'auto'):
+            refresh = await self._config_changed(cached_version)
+        
+        if (cached_version is not None and not refresh):
+            log.info(f'device_config found in cache')
+
+        else:
+            url = self.DEVICEURLS['CONFIG_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token )
+
+            (device_config, result_code) = await self._get(url)
+
+            if (result_code != 200):
+                return False
+
+            await asyncio.to_thread(_store_device_config, self.cache, device_config)
+
+            log.info(f'device_config fetched from server')
+
+        self.functions = await asyncio.to_thread(_load_device_config, self.cache, self, device_config)
+
+        return(self.functions)
+
+    async def _store(self, **values):
+        '''
+        Writes settings to the cache in a worker thread, every write is a database commit.
+        '''
+        def store():
+            for (key_id, value) in values.items():
+                setattr(self.cache, key_id, value)
+
+        await asyncio.to_thread(store)
+
+    async def _config_changed(self, cached_version):
+        if (cached_version is None):
+            return(True)
+
+        version = await self.version(refresh=True)
+        if not version:
+            log.warning(f'could not fetch the config version, using the cached device_config')
+            return(False)
+
+        log.info(f'config version {version} cached version {cached_version}')
+        return(version != cached_version)
+
+    async def version(self, refresh=False):
+        '''
+        Retrieves the configuration version from the server or from the cache (see GiraServer.version).
+
+        :param refresh: boolean if True it will ignore the cache in the database and fetch the version from the server and store it in the cache.
+        :returns: config version of False'''
+
+        version = self.cache.config_version
+
+        if (version and not refresh):
+            log.debug(f'config_version found in cache {version}')
+            return(version)
+
+        if not self.DEVICEURLS and not await self.identity():
+            return(False)
+
+        if not self.cache.token and not await self.authenticate():
+            return (False)
+
+        url = self.DEVICEURLS['CONFIG_URL_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token )
+
+        (json_data, result_code) = await self._get(url)
+
+        if (result_code != 200):
+            return False
+
+        await self._store(config_version=json_data['uid'])
+        return (self.cache.config_version)
+
+    async def authenticate(self, refresh=False):
+        '''
+        authenticate the app at the gira server
+
+        :param refresh: boolean if True it will ignore the cache in the database and fetch the setting from the server and store it in the cache.
+        :returns: Authentication Token or false if the it's not possible authenticate.
+        '''
+        if (self.cache.vpn and not self.cache.cookie):
+            await self.vpn_login(refresh=True)
+
+        if (self.cache.vpn and self.cache.cookie):
+            hostname = self.cache.vpn_hostname
+        else:
+            hostname = self.cache.hostname
+
+        if (self.cache.token and not refresh):
+            log.debug(f'token found in cache {self.cache.token}')
+            if not self.DEVICEURLS:
+                await self.identity()
+            return(self.cache.token)
+
+        if not self.DEVICEURLS and not await self.identity(refresh=refresh):
+            return(False)
+
+        url = self.DEVICEURLS['AUTHENTICATION_URL'].format(host=hostname)
+
+        data = {"client": self.cache.name}
+
+        log.info(f'connect to {url}')
+
+        r = await self._fetch('POST', url,
+                              json=data,
+                              cookies=self.cookies,
+                              auth=aiohttp.BasicAuth(self.cache.username, self.cache.password))
+        if (r.status == 201):
+            await self._store(token=(await r.json(content_type=None))['token'])
+            log.info(f'token received')
+            return(self.cache.token)
+
+        text = await r.text()
+
+        log.critical(f'Error logging into server {url}: {r.status} {text}')
+        self.errors.append(f'Error logging into server{url}: {r.status} {text} authentication failed')
+        return(False)
+
+    async def identity(self, refresh=False):
+        '''
+        Get the type of server (identity) from the X1/Home server.
+
+        :param refresh: boolean if True it will ignore the cache in the database and fetch the setting from the server and store it in the cache.
+        :returns: True of False
+        '''
+        if (not refresh and self.cache.devicetype):
+            self.DEVICEURLS = DeviceTypes[self.cache.devicetype]
+            return (True)
+
+        url = IdentityURl.format(host=self.cache.vpn_hostname or self.cache.hostname)
+        (jdata, status_code) = await self._get(url)
+        if status_code != 200:
+            return (False)
+
+        self.DEVICETYPE = jdata
+
+        if self.DEVICETYPE['deviceType'] in DeviceTypes:
+            log.info (f'Devicetype found: {self.DEVICETYPE["deviceType"]} ({self.DEVICETYPE["deviceName"]})')
+            self.DEVICEURLS = DeviceTypes[self.DEVICETYPE['deviceType']]
+            await self._store(devicetype=self.DEVICETYPE['deviceType'])
+            return (True)
+
+        log.critical(f'Could not find devictype for: {self.DEVICETYPE["deviceType"]} ({self.DEVICETYPE["deviceName"]})')
+        return(False)
+
+    async def put_uid(self, uid, value):
+        '''
+        put_uid will update a uid with a value and sends it as a http put command to the device.
+
+        :param uid: uid from the data point.
+        :param value: data point value to be set
+        :returns: True of False
+        '''
+        log.debug(f'set {uid} to {value}')
+        return(await self.put_uids({uid: value}))
+
+    async def put_uids(self, values, chunk_size=None):
+        '''
+        put_uids will update many uids at once, the chunks are sent concurrently (see GiraServer.put_uids).
+
+        :param values: dict with uid as key and the data point value to be set as value.
+        :param chunk_size: maximum number of values per put, defaults to AsyncGiraServer.put_chunk_size.
+        :returns: True if all values were accepted by the device, False otherwise.
+        '''
+        if not await self._connected():
+            return(False)
+
+        chunk_size = chunk_size or self.put_chunk_size
+        url = self.DEVICEURLS['PUT_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
+        items = [{"uid": uid, "value": value} for (uid, value) in values.items()]
+
+        puts = [self._put(url, {"values": items[start:start + chunk_size]}) for start in range(0, len(items), chunk_size)]
+        results = await asyncio.gather(*puts)
+
+        return(all(status_code < 300 for (data, status_code) in results))
+
+    async def get_uid(self, uid):
+        '''
+        get_uid pull retreive the current value of the data point of function.
+
+        :param uid: uid from the data point or function.
+        :returns: data dict or None
+        '''
+        log.debug(f'try to fetch {uid}')
+        if not await self._connected():
+            return(None)
+
+        url = self.DEVICEURLS['GET_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, uid=uid, token=self.cache.token)
+        (data, status_code) = await self._get(url)
+
+        if (status_code == 200):
+            return(data)
+        return (None)
+
+    async def vpn_login(self, refresh=False):
+        '''
+        VPN login (see GiraServer.vpn_login)
+
+        :param refresh: boolean if True it will ignore the cache in the database and fetch the setting from the server and store it in the cache.
+        :returns: True of False
+        '''
+        if not self.cache.vpn:
+            log.info(f'vpn not configured!')
+            return(True)
+
+        if not refresh and self.cache.vpn and self.cache.cookie:
+            return(True)
+
+        if (self.cache.vpn_form):
+            (post_url, post_items) = json.loads(self.cache.vpn_form)
+            post_items.update({'user': self.cache.gira_username, 'password': self.cache.gira_password})
+            if await self._vpn_post(post_url, post_items):
+                return True
+
+            log.info(f'cached login form failed, fetching the form again')
+
+        log.info(f'try to connect to {self.cache.vpn}')
+
+        async with aiohttp.ClientSession(timeout=self.timeout) as portal_session:
+            r = await self._fetch('GET', self.cache.vpn, session=portal_session, endpoint='VPN_PORTAL')
+            (post_url, post_items) = _parse_vpn_form(await r.text(), str(r.url),
+                                                     self.cache.gira_username, self.cache.gira_password)
+
+        await self._store(vpn_form=json.dumps([post_url, {k: v for (k, v) in post_items.items() if k in ['serviceId', 'url']}]))
+
+        return await self._vpn_post(post_url, post_items)
+
+    async def _vpn_post(self, post_url, post_items):
+        log.info(f'post credentials to {post_url}')
+
+        start = time.perf_counter()
+        async with aiohttp.ClientSession(timeout=self.timeout) as portal_session:
+            login_request = await self._fetch('POST', post_url, session=portal_session, endpoint='VPN_PORTAL',
+                                              data=post_items)
+        log.info(f'received {login_request.status}')
+        cookie = await self._store_cookie(login_request.cookies, urlparse(str(login_request.url)).netloc)
+
+        if self.instrumentation.active:
+            self.instrumentation.emit('vpn_login', bool(cookie), time.perf_counter() - start)
+
+        if (cookie):
+            log.info(f'Authentication succeeded received cookie!')
+            return True
+
+        return False
+
+    async def _store_cookie(self, morsels, vpn_hostname=None):
+        # a response without a cookie keeps the current cookie (see GiraServer._store_cookie)
+        if not morsels:
+            log.warning(f'no vpn cookie received, keeping the current cookie')
+            return(None)
+
+        cookie = { k:v.value for (k, v) in morsels.items()}
+        expires = [e for e in (_expires(morsel) for morsel in morsels.values()) if e]
+
+        values = {'cookie': json.dumps(cookie), 'cookie_expires': str(min(expires)) if expires else None}
+        if vpn_hostname:
+            values['vpn_hostname'] = vpn_hostname
+        await self._store(**values)
+        self._attach_cookie()
+
+        return(cookie)
+
+    async def refresh_vpn_cookie(self):
+        '''
+        Renews the VPN cookie, falls back to a full login on the portal when the cookie cannot be renewed.
+
+        :returns: True of False
+        '''
+        if (self.cache.cookie and await self.vpn_connect(refresh=True)):
+            return(True)
+
+        return(await self.vpn_login(refresh=True))
+
+    def start_vpn_refresher(self, interval=3600, margin=300):
+        '''
+        Starts a task on the running loop that renews the VPN cookie before it expires (see
+        GiraServer.start_vpn_refresher). The task is cancelled when the AsyncGiraServer is closed.
+
+        :param interval: seconds between renewals when the cookie has no expiry time.
+        :param margin: seconds before the expiry time the cookie is renewed.
+        '''
+        if not self.cache.vpn or self._vpn_refresher:
+            return(None)
+
+        async def run():
+            while True:
+                if self.cache.cookie_expires:
+                    delay = max(float(self.cache.cookie_expires) - margin - time.time(), 10)
+                else:
+                    delay = interval
+                await asyncio.sleep(delay)
+                try:
+                    await self.refresh_vpn_cookie()
+                except Exception as e:
+                    log.error(f'renewing the vpn cookie failed: {e!r}')
+
+        self._vpn_refresher = asyncio.get_running_loop().create_task(run())
+        log.info(f'vpn cookie refresher started')
+
+    async def vpn_connect(self, refresh=False):
+        '''
+        Validates and refreshes the Cookie of the Gira VPN service (see GiraServer.vpn_connect).
+
+        :param refresh: does not pull take the cookie from the Cache object but fetches it from the Gira VPN service.
+        :returns: cookie dict or None
+        '''
+        if not (self.cache.cookie):
+            return None
+
+        if (not refresh):
+            return (json.loads(self.cache.cookie))
+
+        key = list(json.loads(self.cache.cookie).values())[0]
+
+        url = f'https://{self.cache.vpn_hostname}/httpaccess.net/{key}/'
+
+        async with aiohttp.ClientSession(timeout=self.timeout) as portal_session:
+            login_request = await self._fetch('GET', url, session=portal_session, endpoint='VPN_CONNECT')
+        if not login_request.ok:
+            log.warning(f'renewing the vpn cookie failed with status_code {login_request.status}')
+            return None
+
+        cookie = await self._store_cookie(login_request.cookies)
+
+        log.debug(f'new cookie {self.cache.cookie}')
+
+        return cookie
+
+    async def set_callaback(self, serviceCallback, valueCallback, testCallbacks=True):
+        '''
+        Create a callback for events on the KNX bus on the Gira X1/Homeserver.
+
+        :param serviceCallback: Callback url for service callback's.
+        :param valueCallback: Callback url for datapoint callback's.
+        :param testCallbacks: Test the callback server.
+        :returns: True of False
+        '''
+        if not await self._connected():
+            return(False)
+
+        url = self.DEVICEURLS['CALLBACK_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
+
+        jdata = {
+                'serviceCallback': serviceCallback,
+                'valueCallback': valueCallback,
+                "testCallbacks": testCallbacks
+                }
+
+        (data, status_code) = await self._post(url, jdata)
+
+        if (status_code == 200):
+            log.info('Callback was successfully registered.')
+            return(True)
+
+        log.critical(f'Error logging when communicating to the server {url}')
+        return(False)
+
+    async def delete_callback(self):
+        '''
+        Deletes the call back settings on the Gira X1/Homeserver.
+
+        :returns: True of False
+        '''
+        if not await self._connected():
+            return(False)
+
+        url = self.DEVICEURLS['CALLBACK_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
+
+        (data, status_code) = await self._request('DELETE', url)
+
+        if (status_code == 200):
+            log.info('Callback was successfully deleted.')
+            return(True)
+
+        log.critical(f'Error delete client from  server {url}: {data}')
+        return(False)
+
+    async def _request(self, method, url, data=None):
+        '''
+        Sends a request over the pooled http session and returns a tuple (json data or text, status code).
+        '''
+        if (self.cache.vpn and not self.cache.cookie):
+            await self.vpn_login()
+
+        token = self.cache.token
+        (data_received, status_code) = await self._send(method, url, data)
+
+        if not (token and token in url):
+            return(data_received, status_code)
+
+        if (status_code in (401, 403)):
+            log.warning(f'token refused with status_code {status_code}, re-authenticating')
+            self.token_valid = False
+            new_token = await self._reauthenticate(token)
+            if not new_token:
+                return(data_received, status_code)
+
+            # the token is part of the url
+            (data_received, status_code) = await self._send(method, url.replace(token, new_token), data)
+
+        self.token_valid = status_code not in (401, 403)
+        return(data_received, status_code)
+
+    async def _reauthenticate(self, stale_token):
+        async with self._auth_lock:
+            if (self.cache.token and self.cache.token != stale_token):
+                return(self.cache.token)
+
+            self.reauthentications += 1
+            if self.instrumentation.active:
+                self.instrumentation.emit('reauthenticate', stale_token)
+            token = await self.authenticate(refresh=True)
+
+            if not token and self.cache.vpn:
+                log.info(f'authentication failed, renewing the vpn cookie')
+                await self.vpn_login(refresh=True)
+                token = await self.authenticate(refresh=True)
+
+            return(token)
+
+    async def _send(self, method, url, data=None):
+        log.debug(f'{method} {url}')
+
+        if not self.instrumentation.active:
+            return(await self._receive(method, url, data))
+
+        event = RequestStart(method, _endpoint(url), url, time.time())
+        self.instrumentation.emit('request_start', event)
+        start = time.perf_counter()
+        sent = len(json.dumps(data)) if data is not None else 0
+
+        try:
+            (data_received, status_code, size) = await self._receive(method, url, data, measure=True)
+        except Exception as e:
+            self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, None, sent, 0,
+                                                                time.perf_counter() - start, e))
+            raise
+
+        self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, status_code,
+                                                            sent, size, time.perf_counter() - start, None))
+        return(data_received, status_code)
+
+    async def _fetch(self, method, url, session=None, endpoint=None, **kwargs):
+        '''
+        Sends one request for which the response itself is needed (authentication and the VPN portal) and reports
+        it to the instrumentation hooks like _send. The body is read, so it stays available after the response is
+        released.
+
+        :param session: aiohttp.ClientSession to send the request with, defaults to the session of the device.
+        :param endpoint: name of the endpoint for the instrumentation, defaults to the name of the url.
+        :returns: aiohttp.ClientResponse object
+        '''
+        session = session or self._session()
+        log.debug(f'{method} {url}')
+
+        if not self.instrumentation.active:
+            async with session.request(method, url, **kwargs) as r:
+                await r.read()
+            return(r)
+
+        event = RequestStart(method, endpoint or _endpoint(url), url, time.time())
+        self.instrumentation.emit('request_start', event)
+        start = time.perf_counter()
+        if 'json' in kwargs:
+            sent = len(json.dumps(kwargs['json']))
+        else:
+            sent = len(urlencode(kwargs.get('data') or {}))
+
+        try:
+            async with session.request(method, url, **kwargs) as r:
+                body = await r.read()
+        except Exception as e:
+            self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, None, sent, 0,
+                                                                time.perf_counter() - start, e))
+            raise
+
+        self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, r.status,
+                                                            sent, len(body), time.perf_counter() - start, None))
+        return(r)
+
+    async def _receive(self, method, url, data=None, measure=False):
+        async with self._session().request(method, url, json=data, cookies=self.cookies) as r:
+            body = await r.read()
+            if (r.content_type == 'application/json'):
+                result = (json.loads(body), r.status)
+                return(result + (len(body),) if measure else result)
+
+            text = body.decode(r.get_encoding())
+
+        if (r.status < 300):
+            log.debug(f'Received status_code: {r.status} with non json data and data: {text}')
+        else:
+            log.error(f'Received status_code: {r.status} with non json data and data: {text}')
+            self.errors.append(f'Received status_code: {r.status} with non json data and data: {text}')
+
+        return((text, r.status, len(body)) if measure else (text, r.status))
+
+    async def _get(self, url):
+        (data, status_code) = await self._request('GET', url)
+        return(data if isinstance(data, (dict, list)) else None, status_code)
+
+    async def _put(self, url, data):
+        (data, status_code) = await self._request('PUT', url, data)
+        return(None, status_code)
+
+    async def _post(self, url, data):
+        (data, status_code) = await self._request('POST', url, data)
+        return(data if isinstance(data, (dict, list)) else None, status_code)
+
+
+def _expires(morsel):
+    # expiry time (epoch) of a cookie morsel or None
+    if morsel['max-age']:
+        return(time.time() + int(morsel['max-age']))
+    if morsel['expires']:
+        try:
+            return(parsedate_to_datetime(morsel['expires']).timestamp())
+        except (TypeError, ValueError):
+            return(None)
+    return(None)
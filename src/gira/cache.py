@@ -36,33 +36,198 @@ retrieve the the data from the database.
 
 Be carefull to call gira.CacheObject instead of CacheBase which is the base class. 
 
+By default every assignment is written to the database right away. In write-back mode the values are only kept in
+memory and the changed keys are written in one transaction when :meth:`CacheBase.flush` or 
+:meth:`CacheBase.close` is called, or every flush_interval seconds. Keys in write_through are always written 
+immediately.
+
+With preload=True all the settings of the instance are read with a single query when the object is created. After
+that a variable that is not in the database is known to be missing, it is returned as None without another query.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira import CacheObject
+    >>> myObject = CacheObject(dburi="sqlite:////tmp/gira.db", write_back=True, flush_interval=5)
+    >>> myObject.someSetting = 'MyValue'
+    >>> myObject.otherSetting = 'OtherValue'
+    >>> myObject.flush()
+    >>> myObject = CacheObject(dburi="sqlite:////tmp/gira.db", preload=True)
+    >>> myObject.someSetting
+    'MyValue'
+
+Large values, like the device configuration, do not belong in the key/value path. They are stored compressed 
+(zstd when the zstandard package is installed, zlib otherwise) in a separate table, tagged with a version, and are 
+only read from the database when they are requested.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> myObject.set_blob('device_config', json.dumps(config), version=config['uid'])
+    >>> myObject.blob_version('device_config')
+    'a0a0'
+    >>> config = json.loads(myObject.get_blob('device_config', version='a0a0'))
+
+The object counts the variables that were looked up in the database (hits and misses) and the queries it sent
+(round_trips). When instrumentation is set to a :class:`gira.instrument.Instrumentation` object every database
+lookup and write is reported with its duration, :class:`gira.device.GiraServer` shares its own with the cache.
+
 """
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import sqlalchemy
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import atexit
+import zlib
 import logging
 log = logging.getLogger(__name__)
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-Base = declarative_base()
+_declare_lock = threading.Lock()
 
-class Setting(Base):
-    """sqlalchemy database schema for the settings cache table"""
-    
-    __tablename__ = 'cached_attributes'
-    
-    instance = sqlalchemy.Column((sqlalchemy.String(255)), primary_key=True)
-    """Primay Key (String) on instance and key_id"""
+
+def _declare_models():
+    '''
+    Imports sqlalchemy and declares the tables. Importing sqlalchemy and its ORM takes longer than the rest of the
+    library together, so it is done when the first cache object is created instead of at import time.
+    '''
+    global sqlalchemy, sessionmaker, scoped_session, Base, Setting, Blob
     
-    key_id = sqlalchemy.Column(sqlalchemy.String(255), primary_key=True)
-    """Primay Key (String) on instance and key_id"""
+    with _declare_lock:
+        if 'Base' in globals():
+            return
+        
+        import sqlalchemy
+        from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
+
+        Base = declarative_base()
+
+        class Setting(Base):
+            """sqlalchemy database schema for the settings cache table"""
+
+            __tablename__ = 'cached_attributes'
+
+            instance = sqlalchemy.Column((sqlalchemy.String(255)), primary_key=True)
+            """Primay Key (String) on instance and key_id"""
+
+            key_id = sqlalchemy.Column(sqlalchemy.String(255), primary_key=True)
+            """Primay Key (String) on instance and key_id"""
+
+            value = sqlalchemy.Column(sqlalchemy.Text(4294000000))
+            """ Value (String)"""
+
+            # Lets us print out a user object conveniently.
+            def __repr__(self):
+                return f"<Setting(instance='{self.instance}' id='{self.key_id}', value='{self.value}')>"
+
+        class Blob(Base):
+            """sqlalchemy database schema for the compressed large values table"""
+
+            __tablename__ = 'cached_blobs'
+
+            instance = sqlalchemy.Column((sqlalchemy.String(255)), primary_key=True)
+            """Primay Key (String) on instance and key_id"""
+
+            key_id = sqlalchemy.Column(sqlalchemy.String(255), primary_key=True)
+            """Primay Key (String) on instance and key_id"""
+
+            version = sqlalchemy.Column(sqlalchemy.String(255))
+            """Version (String) of the value, e.g. the uid of the device configuration"""
+
+            codec = sqlalchemy.Column(sqlalchemy.String(16))
+            """Compression (String) 'zstd' or 'zlib'"""
+
+            data = sqlalchemy.Column(sqlalchemy.LargeBinary(4294000000))
+            """Compressed value (Bytes)"""
+
+            def __repr__(self):
+                return f"<Blob(instance='{self.instance}' id='{self.key_id}', version='{self.version}', codec='{self.codec}')>"
+
+def __getattr__(name):
+    # Base, Setting and Blob (and the sqlalchemy module) are declared on first use
+    if name in ('sqlalchemy', 'sessionmaker', 'scoped_session', 'Base', 'Setting', 'Blob'):
+        _declare_models()
+        return(globals()[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+_databases = {}
+"""dict with per (dburi, echo, future) the gira.cache._Database shared by the cache objects"""
+_schemas = set()
+"""(dburi, echo, future) keys of the databases whose tables were created (or found) already, an in-memory database
+exists per engine"""
+_databases_lock = threading.Lock()
+
+
+class _Database(object):
+    '''
+    Engine (with its connection pool) and thread local session factory shared by all cache objects of a dburi.
+    '''
     
-    value = sqlalchemy.Column(sqlalchemy.Text(4294000000))
-    """ Value (String)"""
+    def __init__(self, dburi, echo, future):
+        url = sqlalchemy.engine.make_url(dburi)
+        options = {}
+        self.lock = None
+        """lock shared by the cache objects when the database has a single connection, None otherwise"""
+        
+        if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+            # an in-memory database only exists within its connection, all threads have to share that connection
+            options = {'poolclass': sqlalchemy.pool.StaticPool, 'connect_args': {'check_same_thread': False}}
+            self.lock = threading.RLock()
+        
+        self.engine = sqlalchemy.create_engine(dburi, echo=echo, future=future, **options)
+        self.sessionmaker = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.session = scoped_session(self.sessionmaker)
+
+
+def _database(dburi, echo, future):
+    '''
+    Returns the shared database of a dburi, the engine is created and the tables are checked only once.
+    '''
+    key = (dburi, echo, future)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = _databases[key] = _Database(dburi, echo, future)
+            log.debug(f'created engine for {database.engine.url!r}')
+        
+        if key not in _schemas:
+            Base.metadata.create_all(database.engine)
+            _schemas.add(key)
+        
+        return(database)
+
+
+def dispose_engines():
+    '''
+    Closes the connection pools of all databases, the next cache object creates them again. Call it in a child 
+    process after a fork, connections must not be shared between processes.
+    '''
+    with _databases_lock:
+        for database in _databases.values():
+            database.session.remove()
+            database.engine.dispose()
+        _databases.clear()
+        _schemas.clear()
+
+
+def _compress(data):
+    if zstandard:
+        return('zstd', zstandard.ZstdCompressor().compress(data))
+    return('zlib', zlib.compress(data))
+
+
+def _decompress(codec, data):
+    if codec == 'zstd':
+        if not zstandard:
+            raise RuntimeError('zstandard is required to read this cached value')
+        return(zstandard.ZstdDecompressor().decompress(data))
+    return(zlib.decompress(data))
 
-    # Lets us print out a user object conveniently.
-    def __repr__(self):
-        return f"<Setting(instance='{self.instance}' id='{self.key_id}', value='{self.value}')>"
 
 class CacheBase(object):
     '''
@@ -72,43 +237,181 @@ class CacheBase(object):
     :param instance: Instance name, used as a primary key for storing settings.
     :param echo: echo sql statements by sqlalchemy. 
     :param future: see sqlalchemy documentation. 
+    :param write_back: boolean if True assignments are kept in memory and written to the database by flush().
+    :param flush_interval: seconds after which pending writes are flushed in the background (write_back only).
+    :param write_through: variable names that are always written to the database immediately.
+    :param preload: boolean if True all the settings of the instance are loaded with one query at startup.
+
+    All cache objects of a dburi share one engine and connection pool, the tables are only created (or checked) by
+    the first one. Every thread uses its own session and every operation returns its connection to the pool when
+    it is done, so a cache object can be used from many threads and many instances do not hold many connections.
     '''
     
     _ignore_ = ['instance', 'engine', 'sessionmaker', 'session', 'get_variable',  
-                'set_variable', '__dict__', 'ignore', 'set_ignore']
+                'set_variable', '__dict__', 'ignore', 'set_ignore', 'write_back', 'flush_interval',
+                'write_through', '_dirty', '_lock', '_timer', '_preloaded', 'instrumentation', 'hits', 'misses',
+                'round_trips']
                     
-    def __init__(self, dburi="file::memory:?cache=shared", instance="cache", echo=False, future=True):
+    def __init__(self, dburi="file::memory:?cache=shared", instance="cache", echo=False, future=True,
+                 write_back=False, flush_interval=None, write_through=('token', 'cookie'), preload=False):
 
         log.debug(f'started')
-        self.engine = sqlalchemy.create_engine(dburi, echo=echo, future=future)
-        Base.metadata.create_all(self.engine)
+        _declare_models()
+        database = _database(dburi, echo, future)
+        self.engine = database.engine
+        self.sessionmaker = database.sessionmaker
+        self.session = database.session
+        """sqlalchemy.orm.scoped_session, the session of the current thread"""
         
         self.instance = instance
-        self.sessionmaker = sessionmaker(bind=self.engine)
-        self.session = self.sessionmaker()
         self.ignore = []
         
+        self.write_back = write_back
+        self.flush_interval = flush_interval
+        self.write_through = list(write_through)
+        self._dirty = set()
+        self._lock = database.lock or threading.RLock()
+        self._timer = None
+        self._preloaded = False
+        
+        self.instrumentation = None
+        """gira.instrument.Instrumentation object that receives the cache_lookup and cache_write events"""
+        self.hits = 0
+        """Number of variables that were not in memory and were found in the database"""
+        self.misses = 0
+        """Number of variables that were not in memory and not in the database either"""
+        self.round_trips = 0
+        """Number of queries sent to the database"""
+        
+        if (write_back):
+            atexit.register(_flush_at_exit, weakref.ref(self))
+            
+        if (preload):
+            self.preload()
+        
+    @contextmanager
+    def _transaction(self):
+        '''
+        Holds the lock and returns the session of the current thread, its connection goes back to the pool and its 
+        objects are released when the block ends.
+        '''
+        with self._lock:
+            try:
+                yield self.session
+            finally:
+                self.session.remove()
+
+    def preload(self):
+        """
+        Loads all the settings of the instance with a single query. Variables that are not loaded are known to be 
+        missing from then on and are not looked up in the database anymore.
+        """
+        
+        with self._transaction() as session:
+            settings = session.query(Setting).filter(Setting.instance == self.instance).all()
+            self.round_trips += 1
+            for setting in settings:
+                if not setting.key_id in self.__dict__:
+                    self.__dict__[setting.key_id] = setting.value
+            self._preloaded = True
+            
+        log.debug(f'preloaded {len(settings)} settings.')
+        
     def invalidate(self):
-        """Deletes the cache from the database"""
+        """Deletes the cache from the database and the values held in memory"""
         
-        self.session.query(Setting).filter(Setting.instance==self.instance).delete()
-        self.session.commit()
+        with self._transaction() as session:
+            self._dirty.clear()
+            session.query(Setting).filter(Setting.instance==self.instance).delete()
+            session.query(Blob).filter(Blob.instance==self.instance).delete()
+            session.commit()
+            
+            for key_id in list(self.__dict__):
+                if not key_id in self._ignore_ and not key_id in self.ignore:
+                    del self.__dict__[key_id]
+                    
         log.debug(f'deleted all cached settings.')
+    
+    def delete(self, key_id):
+        """Deletes a variable from the database and from memory."""
+        
+        with self._transaction() as session:
+            self._dirty.discard(key_id)
+            session.query(Setting).filter(Setting.instance == self.instance, Setting.key_id == key_id).delete()
+            session.commit()
+            self.round_trips += 1
+            self.__dict__.pop(key_id, None)
+        
+        log.debug(f'deleted {key_id}.')
+    
+    def flush(self):
+        """Writes all pending (write-back) values to the database in one transaction."""
+        
+        with self._transaction() as session:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            
+            if not self._dirty:
+                return(None)
+            
+            values = {key_id: self.__dict__.get(key_id) for key_id in self._dirty}
+            settings = session.query(Setting).filter(Setting.instance == self.instance, 
+                                                     Setting.key_id.in_(list(values))).all()
+            for setting in settings:
+                setting.value = values.pop(setting.key_id)
+                
+            for (key_id, value) in values.items():
+                session.add(Setting(instance=self.instance, key_id=key_id, value=value))
+            
+            session.commit()
+            self.round_trips += 2
+            log.debug(f'flushed {len(self._dirty)} settings.')
+            self._dirty.clear()
+        
+        return(None)
+    
+    def close(self):
+        """Flushes the pending values and closes the database session of the current thread."""
+        
+        self.flush()
+        self.session.remove()
+        
+    def _mark_dirty(self, key_id):
+        
+        if (key_id in self.ignore):
+            return(None)
+        
+        with self._lock:
+            self._dirty.add(key_id)
+            if self.flush_interval and not self._timer:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        
+        return(None)
                 
     def _set_variable(self,key_id,value):
         
         if (key_id in self.ignore):
             return(None)
 
-        setting = self.session.query(Setting).filter(Setting.instance == self.instance, Setting.key_id == key_id).first()        
-        
-        if not (setting):
-            setting = Setting(instance=self.instance, key_id=key_id, value=value)
-            self.session.add(setting)
-        else:
-            setting.value = value
+        start = time.perf_counter()
+        with self._transaction() as session:
+            self._dirty.discard(key_id)
+            setting = session.get(Setting, (self.instance, key_id))
+            
+            if not (setting):
+                setting = Setting(instance=self.instance, key_id=key_id, value=value)
+                session.add(setting)
+            else:
+                setting.value = value
+            
+            session.commit()
+            self.round_trips += 2
         
-        self.session.commit()
+        if self.instrumentation and self.instrumentation.active:
+            self.instrumentation.emit('cache_write', key_id, time.perf_counter() - start)
         return(None)
 
 
@@ -117,12 +420,94 @@ class CacheBase(object):
         if (key_id in self.ignore):
             return(None)
 
-        setting = self.session.query(Setting).filter(Setting.instance == self.instance, Setting.key_id == key_id).first()
+        if (self._preloaded):
+            with self._lock:
+                self.misses += 1
+            return(None)
+
+        start = time.perf_counter()
+        with self._transaction() as session:
+            setting = session.get(Setting, (self.instance, key_id))
+            self.round_trips += 1
+            if setting:
+                self.hits += 1
+            else:
+                self.misses += 1
+        
+        if self.instrumentation and self.instrumentation.active:
+            self.instrumentation.emit('cache_lookup', key_id, bool(setting), time.perf_counter() - start)
+        
         if setting:
             return setting.value
         
         return(None)
     
+    def set_blob(self, key_id, value, version=None):
+        '''
+        Stores a large value compressed in the blob table.
+        
+        :param key_id: name of the value.
+        :param value: str or bytes, a str is stored utf-8 encoded.
+        :param version: version of the value, e.g. the uid of the device configuration.
+        '''
+        
+        if isinstance(value, str):
+            value = value.encode()
+        
+        (codec, data) = _compress(value)
+        
+        start = time.perf_counter()
+        with self._transaction() as session:
+            session.merge(Blob(instance=self.instance, key_id=key_id, version=version, codec=codec, data=data))
+            session.commit()
+            self.round_trips += 2
+        
+        if self.instrumentation and self.instrumentation.active:
+            self.instrumentation.emit('cache_write', key_id, time.perf_counter() - start)
+        
+        log.debug(f'stored {key_id} version {version}: {len(value)} bytes compressed to {len(data)} bytes')
+        return(None)
+
+    def get_blob(self, key_id, version=None):
+        '''
+        Loads and decompresses a large value from the blob table.
+        
+        :param key_id: name of the value.
+        :param version: if set, the value is only returned when it was stored with this version.
+        :returns: bytes or None if there is no (matching) value.
+        '''
+        
+        start = time.perf_counter()
+        with self._transaction() as session:
+            query = session.query(Blob.codec, Blob.data).filter(Blob.instance == self.instance, Blob.key_id == key_id)
+            if version:
+                # a value of another version is not read at all
+                query = query.filter(Blob.version == version)
+            row = query.first()
+            self.round_trips += 1
+        
+        if self.instrumentation and self.instrumentation.active:
+            self.instrumentation.emit('cache_lookup', key_id, bool(row), time.perf_counter() - start)
+        
+        if not row:
+            return(None)
+        
+        return(_decompress(row.codec, row.data))
+    
+    def blob_version(self, key_id):
+        '''
+        Returns the version of a value in the blob table without loading the value itself.
+        
+        :param key_id: name of the value.
+        :returns: version or None if there is no value.
+        '''
+        
+        with self._transaction() as session:
+            row = session.query(Blob.version).filter(Blob.instance == self.instance, Blob.key_id == key_id).first()
+            self.round_trips += 1
+        
+        return(row.version if row else None)
+    
     def set_ignore(self,ignore_list):
         '''
         sets the variables names that should not be stored in the cache.
@@ -131,11 +516,24 @@ class CacheBase(object):
         '''
         self.ignore = self.ignore + ignore_list
     
+def _flush_at_exit(ref):
+    cache = ref()
+    if cache is not None:
+        cache.flush()
+
+
 class CacheObject(CacheBase):
 
     def __setattr__(self, name, value):
 
         if not name in super(CacheObject, self)._ignore_:
+            if name in self.__dict__ and self.__dict__[name] == value:
+                return(None)
+            
+            if self.write_back and not name in self.write_through:
+                super(CacheObject, self).__dict__[name] = value
+                return super(CacheObject, self)._mark_dirty(name)
+            
             super(CacheObject, self)._set_variable(name,value)
             
         super(CacheObject, self).__dict__[name] = value
@@ -0,0 +1,204 @@
+"""Module to receive the callbacks of one or more X1/Homeservers.
+
+The X1 posts the changes on the KNX bus as batches of events to the value callback url that was registered with
+:meth:`gira.device.GiraServer.set_callaback`. The :class:`CallbackServer` updates the `value` of the
+:class:`gira.device.Datapoint` in place and hands every event to a bounded queue that the application consumes.
+When the queue is full the request waits for room (backpressure) until put_timeout, after which the batch is
+refused with a 503 status code.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> import asyncio
+    >>> from gira.callback import CallbackServer
+    >>> async def main(config):
+    ...     receiver = CallbackServer(queue_size=10000)
+    ...     receiver.add(config)
+    ...     await receiver.start(host='0.0.0.0', port=5001, ssl_context=ssl_context)
+    ...     async for event in receiver.events():
+    ...         print(event.uid, event.value, event.datapoint)
+
+The X1 identifies itself with the token of the client in every callback, events are routed to the DeviceConfig that
+was added with that token. With a single DeviceConfig events with an unknown token are routed to it as well.
+
+"""
+
+import logging
+import json
+import time
+import asyncio
+from collections import namedtuple
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['timestamp', 'uid', 'value', 'datapoint'])
+"""A value change received from the X1: timestamp (time.time()), uid, value and the gira.device.Datapoint or None"""
+
+_OK = b'{"status":"OK"}'
+_BUSY = b'{"status":"BUSY"}'
+_BAD_REQUEST = b'{"status":"BAD_REQUEST"}'
+
+
+class CallbackServer(object):
+    '''
+    aiohttp based receiver for the value and service callbacks of the X1/Homeserver.
+
+    :param queue_size: maximum number of events waiting in the queue.
+    :param put_timeout: seconds a request waits for room in a full queue before it is refused.
+    :param value_path: url path of the value callback.
+    :param service_path: url path of the service callback.
+    :param on_service: optional callable that receives the (dict) body of every service callback.
+    '''
+
+    def __init__(self, queue_size=10000, put_timeout=1.0, value_path='/giraapi/value',
+                 service_path='/giraapi/function', on_service=None):
+
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.put_timeout = put_timeout
+        self.value_path = value_path
+        self.service_path = service_path
+        self.on_service = on_service
+        self.configs = {}
+        self.runner = None
+
+        self.events_received = 0
+        """Number of events received"""
+        self.events_unknown = 0
+        """Number of events for a uid that is not a datapoint of the DeviceConfig"""
+        self.batches_refused = 0
+        """Number of callbacks refused because the queue stayed full"""
+
+        self.app = web.Application()
+        self.app.router.add_post(value_path, self.handle_value)
+        self.app.router.add_post(service_path, self.handle_service)
+        self.app.router.add_route('*', '/giraapi/test', self.handle_test)
+
+    def add(self, config, token=None):
+        '''
+        Routes the callbacks of a device to its configuration.
+
+        :param config: gira.device.DeviceConfig object
+        :param token: token the device uses in its callbacks, defaults to the token in the cache of the config.
+        '''
+        token = token or (config.cache.token if config.cache else None)
+        self.configs[token] = config
+        log.info(f'receiving callbacks for token {token}')
+
+    def remove(self, token):
+        '''
+        Stops routing the callbacks of the device with this token.
+        '''
+        self.configs.pop(token, None)
+
+    async def start(self, host='0.0.0.0', port=5001, ssl_context=None):
+        '''
+        Starts listening, the server runs on the event loop until :meth:`CallbackServer.stop` is called.
+
+        :param host: address to listen on.
+        :param port: port to listen on.
+        :param ssl_context: ssl.SSLContext, the X1 only calls back to https urls.
+        '''
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port, ssl_context=ssl_context)
+        await site.start()
+        log.info(f'listening on {host}:{port}')
+
+    async def stop(self):
+        '''
+        Stops listening.
+        '''
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def events(self):
+        '''
+        Async iterator over the received events.
+        '''
+        while True:
+            event = await self.queue.get()
+            self.queue.task_done()
+            yield event
+
+    def _config(self, token):
+        config = self.configs.get(token)
+        if config is None and len(self.configs) == 1:
+            config = next(iter(self.configs.values()))
+        return(config)
+
+    async def handle_value(self, request):
+        '''
+        Handles a value callback: updates the datapoints and queues the events.
+        '''
+        body = await _read_json(request)
+        if body is None:
+            return(web.Response(status=400, body=_BAD_REQUEST, content_type='application/json'))
+
+        events = body.get('events')
+        if not events:
+            return(web.Response(body=_OK, content_type='application/json'))
+
+        config = self._config(body.get('token'))
+        # only datapoints have a value, an event for a function uid is treated as unknown
+        uids = config.dataPiont_uids if config else {}
+        now = time.time()
+        debug = log.isEnabledFor(logging.DEBUG)
+        queue = self.queue
+
+        self.events_received += len(events)
+
+        for index, event in enumerate(events):
+            uid = event['uid']
+            value = event['value']
+            dp = uids.get(uid)
+
+            if dp is None:
+                self.events_unknown += 1
+                if debug:
+                    log.debug(f'event for unknown uid {uid}')
+            else:
+                dp.value = value
+
+            try:
+                queue.put_nowait(Event(now, uid, value, dp))
+            except asyncio.QueueFull:
+                try:
+                    await asyncio.wait_for(queue.put(Event(now, uid, value, dp)), self.put_timeout)
+                except asyncio.TimeoutError:
+                    self.batches_refused += 1
+                    log.warning(f'event queue full, refused {len(events) - index} events')
+                    return(web.Response(status=503, body=_BUSY, content_type='application/json'))
+
+        return(web.Response(body=_OK, content_type='application/json'))
+
+    async def handle_service(self, request):
+        '''
+        Handles a service callback (e.g. restart or uiConfigChanged of the device).
+        '''
+        body = await _read_json(request)
+        if body is None:
+            return(web.Response(status=400, body=_BAD_REQUEST, content_type='application/json'))
+
+        log.info(f'service callback received: {body}')
+        if self.on_service:
+            self.on_service(body)
+        return(web.Response(body=_OK, content_type='application/json'))
+
+    async def handle_test(self, request):
+        '''
+        Answers the test callbacks the device sends when the callbacks are registered.
+        '''
+        return(web.Response(body=_OK, content_type='application/json'))
+
+
+async def _read_json(request):
+    # the (dict) body of a callback or None when it is not a json object
+    try:
+        body = json.loads(await request.read())
+    except ValueError:
+        log.warning(f'callback with invalid json received')
+        return(None)
+    return(body if isinstance(body, dict) else None)
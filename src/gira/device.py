@@ -2,17 +2,25 @@
 """
 
 import logging
-import requests
-from requests.auth import HTTPBasicAuth
-import urllib3
+import gc
+import re
+import sys
+import time
+import threading
 import uuid
 import socket
 from urllib.parse import urljoin, urlparse
 import json
-from lxml import etree
-from io import StringIO
+import pickle
+import inspect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice, repeat
+from operator import attrgetter
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from gira.subscription import Subscription
+from gira.scheduler import WriteScheduler
+from gira.instrument import Instrumentation, RequestStart, RequestEnd
 
 log = logging.getLogger(__name__)
 log.debug(f'{__name__} loaded')
@@ -34,6 +42,20 @@ DeviceTypes = {
         }
     }    
 
+_Endpoints = [(name, re.compile('[^/?&]+'.join(re.escape(part) for part in re.split(r'\{\w+\}', url))))
+              for urls in DeviceTypes.values() for (name, url) in urls.items()] + \
+             [('IDENTITY', re.compile(re.escape(IdentityURl).replace(re.escape('{host}'), '[^/?&]+')))]
+
+
+def _endpoint(url):
+    '''
+    Returns the name of the url in DeviceTypes (e.g. GET_UID), IDENTITY or OTHER.
+    '''
+    for (name, pattern) in _Endpoints:
+        if pattern.fullmatch(url):
+            return(name)
+    return('OTHER')
+
 class GiraServer(object):
     '''
     class to interact with the REST API.
@@ -49,6 +71,31 @@ class GiraServer(object):
     :param gira_username: username of the https://geraeteportal.gira.de/ portal
     :param gira_password: pasword of the https://geraeteportal.gira.de/ portal
     :param refresh: boolean if True it will delete the cached settings.
+    :param pool_connections: number of connection pools (one per host) kept by the http session.
+    :param pool_maxsize: maximum number of connections kept alive per host.
+    :param timeout: timeout in seconds for every request, either a float or a (connect, read) tuple.
+    :param keep_alive: boolean if False every request closes its connection after it is done.
+    :param max_retries: number of retries on connection failures (see requests.adapters.HTTPAdapter).
+    :param put_chunk_size: maximum number of values sent in one PUT request by :meth:`GiraServer.put_uids`.
+    :param instrumentation: gira.instrument.Instrumentation object, by default every server gets its own. It is 
+        shared with the cache when the cache does not have one yet.
+    :param verify: TLS verification of the device, False by default because the X1/Homeserver has a certificate of 
+        the Gira CA, or the path of a CA bundle that holds it.
+    :param lazy: boolean if True the constructor does not do any network I/O. The VPN login, identity and 
+        authentication are done by :meth:`GiraServer.connect` or by the first operation that needs them.
+
+    A request that is refused with 401 or 403 because the token (or VPN cookie) expired re-authenticates and is sent
+    once more. When many threads hit an expired token at the same time only one of them re-authenticates, the others
+    wait for it and reuse the new token.
+
+    The object holds one persistent http session with a connection pool that is shared by all requests. Close it
+    with :meth:`GiraServer.close` or use the object as a context manager.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        with GiraServer(hostname, username, password, cache) as server:
+            server.get_device_config()
 
     '''
 
@@ -61,7 +108,16 @@ class GiraServer(object):
                  vpn=False,
                  gira_username=None,
                  gira_password=None,
-                 refresh=False):
+                 refresh=False,
+                 pool_connections=4,
+                 pool_maxsize=10,
+                 timeout=(10, 60),
+                 keep_alive=True,
+                 max_retries=0,
+                 put_chunk_size=100,
+                 instrumentation=None,
+                 verify=False,
+                 lazy=False):
                
         log.debug(f'{__name__} started')
         
@@ -87,13 +143,37 @@ class GiraServer(object):
         self.cache.gira_password = gira_password
         self.functions = None
         
+        self.timeout = timeout
+        self.put_chunk_size = put_chunk_size
+        self.write_scheduler = None
+        
+        self.token_valid = None
+        """True after the token was accepted, False after it was refused and None when it was not used yet"""
+        self.reauthentications = 0
+        """Number of times the token was renewed because the device refused it"""
+        self._auth_lock = threading.RLock()
+        self._vpn_refresher = None
+        
+        self.instrumentation = instrumentation or Instrumentation()
+        """gira.instrument.Instrumentation event bus, see gira.instrument"""
+        if cache.instrumentation is None:
+            cache.instrumentation = self.instrumentation
+        
+        self.verify = verify
+        """TLS verification of the device, passed with every request: requests prefers REQUESTS_CA_BUNDLE or 
+        CURL_CA_BUNDLE from the environment over the verify setting of the session"""
+        self.http_session = self._create_session(pool_connections, pool_maxsize, keep_alive, max_retries)
+        self.http_session.verify = verify
+        
+        if cookie:
+            self.cache.cookie = cookie if isinstance(cookie, str) else json.dumps(cookie)
+        
+        self._attach_cookie()
+        
         if (vpn):
             self.cache.vpn = vpn
-            self.vpn_login()
-    
-
-        if cookie:
-            self.cache.cookie = cookie
+            if not lazy:
+                self.vpn_login()
                     
         self.DEVICETYPE = self.DEVICEURLS = None
         
@@ -104,8 +184,111 @@ class GiraServer(object):
             log.critical('Hostname, username and/or password cannot be None')
             return (False)
         
-        self.identity()
+        if not lazy:
+            self.identity()
+        
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Closes the http session and all pooled connections and flushes pending cache writes.
+        '''
+        # the token state and _auth_lock are kept: other threads can still hold the lock, and the cached token stays
+        # valid for the next session
+        self.stop_vpn_refresher()
+        
+        if (self.write_scheduler):
+            self.write_scheduler.close()
+            self.write_scheduler = None
+        
+        if (self.http_session):
+            self.http_session.close()
+            log.debug(f'http session closed')
+        
+        self.cache.flush()
+
+    def enable_write_scheduler(self, interval=0.05):
+        '''
+        Enables coalescing of datapoint writes (see gira.scheduler). From then on Datapoint.set only keeps the latest
+        value per uid and all pending values are sent with one batched put every interval. Datapoint.set then 
+        returns a concurrent.futures.Future that resolves when the value was sent.
+        
+        :param interval: seconds between the first pending write and sending the batch.
+        :returns: gira.scheduler.WriteScheduler object
+        '''
+        if not self.write_scheduler:
+            self.write_scheduler = WriteScheduler(self, interval=interval)
+        return(self.write_scheduler)
+
+    def schedule_put(self, uid, value):
+        '''
+        Schedules a write with the write scheduler, enables it with the default interval when needed.
+        
+        :param uid: uid from the data point.
+        :param value: data point value to be set 
+        :returns: concurrent.futures.Future with the result (True of False) of the put.
+        '''
+        return(self.enable_write_scheduler().schedule(uid, value))
+
+    def _create_session(self, pool_connections, pool_maxsize, keep_alive, max_retries):
+        '''
+        Creates the persistent http session with a connection pool shared by all requests.
+        '''
+        # requests and urllib3 are imported when the first session is created, not when the library is imported
+        import requests
+        import urllib3
+        from requests.adapters import HTTPAdapter
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        
+        http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        
+        http_session.headers.update(Headers)
+        if not keep_alive:
+            http_session.headers['Connection'] = 'close'
+        
+        return(http_session)
+
+    def _attach_cookie(self):
+        '''
+        Attaches the cached (VPN) cookie to the http session. Is called once at startup and every time the cookie 
+        is renewed.
+        '''
+        import requests
+        jar = requests.cookies.cookiejar_from_dict(json.loads(self.cache.cookie) if self.cache.cookie else {})
+        # replace the jar in one assignment, concurrent requests see either the old or the new cookie
+        self.http_session.cookies = jar
+
+    def _store_cookie(self, cookies, vpn_hostname=None):
+        '''
+        Stores a renewed VPN cookie with its expiry time in the cache and attaches it to the http session.
+        
+        :param cookies: requests cookie jar of the response that set the cookie.
+        :returns: cookie dict, or None when the response did not set a cookie. The current cookie is kept then.
+        '''
+        if not cookies:
+            log.warning(f'no vpn cookie received, keeping the current cookie')
+            return(None)
         
+        import requests
+        cookie = requests.utils.dict_from_cookiejar(cookies)
+        expires = [c.expires for c in cookies if c.expires]
+        
+        with self._auth_lock:
+            self.cache.cookie = json.dumps(cookie)
+            self.cache.cookie_expires = str(min(expires)) if expires else None
+            if vpn_hostname:
+                self.cache.vpn_hostname = vpn_hostname
+            self._attach_cookie()
+        
+        return(cookie)
+
     def invalidate_cache(self):
         '''
         This will delete the cache items of database.
@@ -113,37 +296,86 @@ class GiraServer(object):
         if (self.cache):
             self.cache.invalidate()
             
+    def connect(self, refresh=False):
+        '''
+        Logs in to the VPN (when configured), fetches the identity and authenticates at the device. A lazy server 
+        does this on the first operation that needs it, calling connect() moves the network I/O to a moment of 
+        choice, e.g. to connect many servers concurrently at startup. Cached settings are used without a request.
+        
+        :param refresh: boolean if True the cookie, identity and token are fetched from the server again.
+        :returns: Authentication Token or False
+        '''
+        with self._auth_lock:
+            if not self.vpn_login(refresh=refresh):
+                return(False)
+            
+            if not self.identity(refresh=refresh):
+                return(False)
+            
+            return(self.authenticate(refresh=refresh))
+
+    def _connected(self):
+        '''
+        Connects when the device urls or the token are still missing (lazy construction or a failed identity).
+        '''
+        if (self.DEVICEURLS is not None and self.cache.token):
+            return(True)
+        
+        return(bool(self.connect()))
+
     def get_device_config(self, refresh=False):
         '''
         GiraServer.get_device_config retrieves the configuration from the server or from the cache.
         
         :param refresh: boolean if True it will ignore the cache in the database and fetch the configuration from the server and store it in the cache.
+            With 'auto' only the (cheap) configuration uid is fetched from the server, the full configuration is only 
+            downloaded when the uid differs from the version in the cache.
         :returns: DeviceConfig object with configuration of the device or False if the fetching of the device configuration fails. 
         '''
         
+        if not self._connected():
+            return(False)
+        
+        device_config = None
+        cached_version = self.cache.blob_version('device_config')
         
-        self.authenticate()
+        if (refresh == 'auto'):
+            refresh = self._config_changed(cached_version)
         
-        device_config_json = self.cache.device_config_json
-        if (device_config_json and not refresh):
+        if (cached_version is not None and not refresh):
             log.info(f'device_config found in cache')
         
         else:
             url = self.DEVICEURLS['CONFIG_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token )
             
-            (json_data, result_code) = self._get(url)
+            (device_config, result_code) = self._get(url)
             
             if (result_code != 200):
                 return False
             
-            self.cache.device_config_json = json.dumps(json_data)
+            _store_device_config(self.cache, device_config)
             
             log.info(f'device_config fetched from server')
             
-        self.functions = DeviceConfig(cache=self.cache,device=self)
+        self.functions = _load_device_config(self.cache, self, device_config)
         
         return(self.functions)
             
+    def _config_changed(self, cached_version):
+        '''
+        Compares the configuration uid on the server with the version of the cached configuration.
+        '''
+        if (cached_version is None):
+            return(True)
+        
+        version = self.version(refresh=True)
+        if not version:
+            log.warning(f'could not fetch the config version, using the cached device_config')
+            return(False)
+        
+        log.info(f'config version {version} cached version {cached_version}')
+        return(version != cached_version)
+            
     def version(self, refresh=False):
         '''
         GiraServer.version retrieves the configuration version from the server or from the cache.
@@ -192,10 +424,8 @@ class GiraServer(object):
         
         if (self.cache.vpn and self.cache.cookie):
             hostname = self.cache.vpn_hostname
-            cookie = self.vpn_connect()            
         else:
             hostname = self.cache.hostname
-            cookie = None
         
         if (self.cache.token and not refresh):
             log.debug(f'token found in cache {self.cache.token}')
@@ -213,17 +443,12 @@ class GiraServer(object):
         data = {"client": self.cache.name}
         
         log.debug(f'post: {data}')
-        http_session = requests.Session()      
-        
-        log.debug (cookie)      
         
         log.info(f'connect to {url}')
 
-        r = http_session.post(url,
+        from requests.auth import HTTPBasicAuth
+        r = self._send('POST', url,
                     json=data,
-                    headers=Headers,
-                    verify=False,
-                    cookies=cookie,
                     auth=HTTPBasicAuth(self.cache.username, self.cache.password))
 
         if (r.status_code == 201 ):
@@ -276,19 +501,40 @@ class GiraServer(object):
         :returns: True of False
         '''
         
-        url = self.DEVICEURLS['PUT_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
-        data = {"values": [
-                {"uid": uid,
-                 "value": value
-                    }
-            
-            ]}
         log.debug(f'set {uid} to {value}')
-        (data,status_code) = self._put(url, data)
-        if (status_code < 300):
-            return (True)
-        else:
+        return(self.put_uids({uid: value}))
+
+    def put_uids(self, values, chunk_size=None):
+        '''
+        put_uids will update many uids at once. The values are packed in as few http put commands as possible, 
+        each put carries at most chunk_size values.
+        
+        .. highlight:: python
+        .. code-block:: python
+        
+            server.put_uids({'a002': '1', 'a006': '1', 'a00a': '0'})
+        
+        :param values: dict with uid as key and the data point value to be set as value.
+        :param chunk_size: maximum number of values per put, defaults to GiraServer.put_chunk_size.
+        :returns: True if all values were accepted by the device, False otherwise.
+        '''
+        
+        if not self._connected():
             return(False)
+        
+        chunk_size = chunk_size or self.put_chunk_size
+        url = self.DEVICEURLS['PUT_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
+        items = [{"uid": uid, "value": value} for (uid, value) in values.items()]
+        
+        success = True
+        for start in range(0, len(items), chunk_size):
+            data = {"values": items[start:start + chunk_size]}
+            log.debug(f'put {len(data["values"])} values')
+            (data, status_code) = self._put(url, data)
+            if (status_code >= 300):
+                success = False
+        
+        return(success)
 
     def get_uid(self,uid):
         '''
@@ -298,6 +544,9 @@ class GiraServer(object):
         :returns: data dict or None
         '''
         log.debug(f'try to fetch {uid}')
+        if not self._connected():
+            return(None)
+        
         url = self.DEVICEURLS['GET_UID'].format(host=self.cache.vpn_hostname or self.cache.hostname, uid=uid, token=self.cache.token)
         (data,status_code) = self._get(url)
 
@@ -323,41 +572,42 @@ class GiraServer(object):
         if not refresh and self.cache.vpn and self.cache.cookie:
             return(True)
         
-        # 
+        # the login form of the portal rarely changes, it is only scraped again when posting to the cached form fails
+        if (self.cache.vpn_form):
+            (post_url, post_items) = json.loads(self.cache.vpn_form)
+            post_items.update({'user': self.cache.gira_username, 'password': self.cache.gira_password})
+            if self._vpn_post(post_url, post_items):
+                return True
+            
+            log.info(f'cached login form failed, fetching the form again')
+        
         log.info(f'try to connect to {self.cache.vpn}')
         
-        r = requests.get(self.cache.vpn)
+        import requests
+        r = self._send('GET', self.cache.vpn, session=requests, endpoint='VPN_PORTAL')
         
-        post_items = {'user': self.cache.gira_username,
-                      'password': self.cache.gira_password}
-    
-        parser = etree.HTMLParser()
-        tree = etree.parse(StringIO(r.content.decode()), parser)
-        root = tree.getroot()
-    
-        for form in root.xpath('//form'):
-            action_path = form.get('action')
-            
-            for field in form.iterchildren():
-                if field.get('name') in ['serviceId', 'url']:
-                    post_items[field.get('name') ] = field.get('value')
-    
-        post_url = urljoin(r.url, action_path)
+        (post_url, post_items) = _parse_vpn_form(r.content.decode(), r.url, self.cache.gira_username, self.cache.gira_password)
         
-        log.info(f'post credentials to {post_url}')
+        self.cache.vpn_form = json.dumps([post_url, {k: v for (k, v) in post_items.items() if k in ['serviceId', 'url']}])
         
-        log.debug(post_items)
+        return self._vpn_post(post_url, post_items)
+    
+    def _vpn_post(self, post_url, post_items):
+        log.info(f'post credentials to {post_url}')
         
-        login_request = requests.post(post_url, data=post_items)
+        import requests
+        start = time.perf_counter()
+        login_request = self._send('POST', post_url, session=requests, endpoint='VPN_PORTAL', data=post_items)
         
         log.info(f'received {login_request.status_code}')
-    
-        cookie = { k:v for (k, v) in login_request.cookies.items()}
-        self.cache.cookie = json.dumps(cookie)
-        self.cache.vpn_hostname = urlparse(login_request.url).netloc
         
-        if (self.cache.cookie):
-            log.info(f'Authentication succeeded received cookie! {self.cache.cookie}')
+        cookie = self._store_cookie(login_request.cookies, urlparse(login_request.url).netloc)
+        
+        if self.instrumentation.active:
+            self.instrumentation.emit('vpn_login', bool(cookie), time.perf_counter() - start)
+        
+        if (cookie):
+            log.info(f'Authentication succeeded received cookie!')
             return True
         
         return False
@@ -382,13 +632,69 @@ class GiraServer(object):
         
         url = f'https://{self.cache.vpn_hostname}/httpaccess.net/{key}/'
         
-        login_request = requests.get(url)
-        cookie = requests.utils.dict_from_cookiejar(login_request.cookies)
-        self.cache.cookie = json.dumps(cookie)
+        import requests
+        login_request = self._send('GET', url, session=requests, endpoint='VPN_CONNECT')
+        if not login_request.ok:
+            log.warning(f'renewing the vpn cookie failed with status_code {login_request.status_code}')
+            return None
+        
+        cookie = self._store_cookie(login_request.cookies)
         log.debug(f'new cookie {self.cache.cookie}')
                 
         return cookie
 
+    def refresh_vpn_cookie(self):
+        '''
+        Renews the VPN cookie, falls back to a full login on the portal when the cookie cannot be renewed.
+        
+        :returns: True of False
+        '''
+        if (self.cache.cookie and self.vpn_connect(refresh=True)):
+            return(True)
+        
+        return(self.vpn_login(refresh=True))
+
+    def start_vpn_refresher(self, interval=3600, margin=300):
+        '''
+        Starts a background thread that renews the VPN cookie before it expires, so requests never wait for a VPN
+        login. The thread stops when the GiraServer is closed.
+        
+        :param interval: seconds between renewals when the cookie has no expiry time.
+        :param margin: seconds before the expiry time the cookie is renewed.
+        '''
+        if not self.cache.vpn or self._vpn_refresher:
+            return(None)
+        
+        stop = threading.Event()
+        
+        def run():
+            while not stop.wait(self._next_vpn_refresh(interval, margin)):
+                try:
+                    self.refresh_vpn_cookie()
+                except Exception as e:
+                    log.error(f'renewing the vpn cookie failed: {e!r}')
+        
+        self._vpn_refresher = (stop, threading.Thread(target=run, name='gira-vpn-refresher', daemon=True))
+        self._vpn_refresher[1].start()
+        log.info(f'vpn cookie refresher started')
+
+    def stop_vpn_refresher(self):
+        '''
+        Stops the background VPN cookie renewal.
+        '''
+        if self._vpn_refresher:
+            (stop, thread) = self._vpn_refresher
+            stop.set()
+            thread.join()
+            self._vpn_refresher = None
+
+    def _next_vpn_refresh(self, interval, margin):
+        if not self.cache.cookie_expires:
+            return(interval)
+        
+        # renew a little before the expiry time, but not in a tight loop when the renewal does not extend it
+        return(max(float(self.cache.cookie_expires) - margin - time.time(), 10))
+
     def set_callaback(self, serviceCallback, valueCallback, testCallbacks=True):
         '''
         Create a callback for events on the KNX bus on the Gira X1/Homeserver.
@@ -399,6 +705,8 @@ class GiraServer(object):
         :returns: True of False
         
         '''
+        if not self._connected():
+            return(False)
 
         url = self.DEVICEURLS['CALLBACK_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
 
@@ -425,22 +733,12 @@ class GiraServer(object):
         :returns: True of False
 
         '''
-        if (self.cache.vpn and not self.cache.cookie):
-            self.vpn_login()
+        if not self._connected():
+            return(False)
         
-        if (self.cache.vpn and self.cache.cookie):
-            cookie = self.vpn_connect()            
-        else:
-            cookie = None
-
         url = self.DEVICEURLS['CALLBACK_URL'].format(host=self.cache.vpn_hostname or self.cache.hostname, token=self.cache.token)
         
-        http_session = requests.Session()
-
-        r = http_session.delete(url,
-                    headers=Headers,
-                    verify=False ,
-                    cookies=cookie)
+        r = self._request('DELETE', url)
         
         if (r.status_code == 200):
             log.info('Callback was successfully deleted.')
@@ -449,19 +747,87 @@ class GiraServer(object):
         log.critical(f'Error delete client from  server {url}: {r.text}')
         return(False)
 
-    def _put(self, url, data):
+    def _request(self, method, url, **kwargs):
+        '''
+        Sends a request over the pooled http session, logs in to the VPN first when there is no cookie yet.
+        '''
         if (self.cache.vpn and not self.cache.cookie):
             self.vpn_login()
         
-        if (self.cache.vpn and self.cache.cookie):
-            cookie = self.vpn_connect()            
-        else:
-            cookie = None
+        token = self.cache.token
+        r = self._send(method, url, **kwargs)
+        
+        if not (token and token in url):
+            return(r)
+        
+        if (r.status_code in (401, 403)):
+            log.warning(f'token refused with status_code {r.status_code}, re-authenticating')
+            self.token_valid = False
+            new_token = self._reauthenticate(token)
+            if not new_token:
+                return(r)
             
+            # the token is part of the url
+            r = self._send(method, url.replace(token, new_token), **kwargs)
+        
+        self.token_valid = r.status_code not in (401, 403)
+        return(r)
 
-        http_session = requests.Session()      
+    def _reauthenticate(self, stale_token):
+        '''
+        Renews a refused token. Only one thread authenticates, threads that were refused the same token wait for it 
+        and get the new token.
+        '''
+        with self._auth_lock:
+            if (self.cache.token and self.cache.token != stale_token):
+                return(self.cache.token)
+            
+            self.reauthentications += 1
+            if self.instrumentation.active:
+                self.instrumentation.emit('reauthenticate', stale_token)
+            token = self.authenticate(refresh=True)
+            
+            if not token and self.cache.vpn:
+                log.info(f'authentication failed, renewing the vpn cookie')
+                self.vpn_login(refresh=True)
+                token = self.authenticate(refresh=True)
+            
+            return(token)
+
+    def _send(self, method, url, session=None, endpoint=None, **kwargs):
+        '''
+        Sends one request over the http session and reports it to the instrumentation hooks.
 
-        r = http_session.put(url, json=data, headers=Headers, verify=False, cookies=cookie)
+        :param session: session to send the request with instead of the http session of the device, the VPN portal
+            is called with the requests module so the cookies and the verify setting of the device are not used.
+        :param endpoint: name of the endpoint for the instrumentation, defaults to the name of the url.
+        '''
+        if session is None:
+            session = self.http_session
+            kwargs['verify'] = self.verify
+        kwargs['timeout'] = self.timeout
+        
+        if not self.instrumentation.active:
+            return(session.request(method, url, **kwargs))
+        
+        event = RequestStart(method, endpoint or _endpoint(url), url, time.time())
+        self.instrumentation.emit('request_start', event)
+        start = time.perf_counter()
+        
+        try:
+            r = session.request(method, url, **kwargs)
+        except Exception as e:
+            self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, None, 0, 0,
+                                                                time.perf_counter() - start, e))
+            raise
+        
+        self.instrumentation.emit('request_end', RequestEnd(method, event.endpoint, url, event.start, r.status_code,
+                                                            len(r.request.body or b''), len(r.content),
+                                                            time.perf_counter() - start, None))
+        return(r)
+
+    def _put(self, url, data):
+        r = self._request('PUT', url, json=data)
 
         if (r.status_code < 300):
             log.debug('Received status_code: %s with non json data and data: %s' % (r.status_code, r.text))
@@ -475,15 +841,8 @@ class GiraServer(object):
     def _get(self, url):
         log.debug(f'connect to {url}')
         
-        http_session = requests.Session()
-        
-        if (self.cache.cookie):
-            cookie = json.loads(self.cache.cookie)
-        else:
-            cookie = None
-        
         log.info(f'get {url}')
-        r = http_session.get(url, headers=Headers, verify=False, cookies=cookie)
+        r = self._request('GET', url)
         
         if (r.headers['Content-Type'] == 'application/json'):
             if len(r.text) < 500:
@@ -501,19 +860,9 @@ class GiraServer(object):
         return(None, r.status_code)
 
     def _post(self, url, data):
-        if (self.cache.vpn and not self.cache.cookie):
-            self.vpn_login()
-        
-        if (self.cache.vpn and self.cache.cookie):
-            cookie = self.vpn_connect()            
-        else:
-            cookie = None
-            
-        http_session = requests.Session()      
-        
         log.debug(f'posting {data}')
 
-        r = http_session.post(url, json=data, headers=Headers, verify=False, cookies=cookie)
+        r = self._request('POST', url, json=data)
         
         if (hasattr(r.headers, 'content-type')):
             if (r.headers['Content-Type'] == 'application/json'):
@@ -529,31 +878,250 @@ class GiraServer(object):
         return(None, r.status_code)
 
 
-class Datapoint(object):
+def _store_device_config(cache, device_config):
+    '''
+    Stores the device configuration compressed in the blob table of the cache, tagged with its uid (version).
+    '''
+    cache.set_blob('device_config', json.dumps(device_config), version=device_config.get('uid'))
+    cache.config_version = device_config.get('uid')
+    # before the blob table the configuration was a (multi-MB) setting, which preload would still read every time
+    cache.delete('device_config_json')
+
+
+def _load_device_config(cache, device, device_config=None):
+    '''
+    Returns the DeviceConfig for the device. Without a (freshly downloaded) device_config the object graph is 
+    restored from the snapshot in the cache when it was taken from the same configuration version, otherwise it is 
+    built and a new snapshot is stored.
+    '''
+    version = f"{cache.blob_version('device_config')}:{DeviceConfig.SNAPSHOT_FORMAT}"
+    
+    if device_config is None:
+        snapshot = cache.get_blob('device_config_snapshot', version=version)
+        if snapshot:
+            try:
+                config = DeviceConfig.from_snapshot(snapshot, cache, device)
+                log.info(f'device_config restored from snapshot {version}')
+                return(config)
+            except Exception as e:
+                log.warning(f'could not restore device_config snapshot {version}: {e}')
+    
+    config = DeviceConfig(cache=cache, device=device, device_config=device_config)
+    cache.set_blob('device_config_snapshot', config.snapshot(), version=version)
+    return(config)
+
+
+def _parse_vpn_form(content, url, gira_username, gira_password):
+    '''
+    Parses the login form of the geraeteportal and returns the url and the items to post the credentials to.
+    '''
+    # lxml is only needed when the login form is scraped, which is rare once the form is cached
+    from lxml import etree
+    from io import StringIO
+    
+    post_items = {'user': gira_username,
+                  'password': gira_password}
+
+    parser = etree.HTMLParser()
+    tree = etree.parse(StringIO(content), parser)
+    root = tree.getroot()
+
+    for form in root.xpath('//form'):
+        action_path = form.get('action')
+        
+        for field in form.iterchildren():
+            if field.get('name') in ['serviceId', 'url']:
+                post_items[field.get('name') ] = field.get('value')
+
+    return(urljoin(url, action_path), post_items)
+
+
+class _Slotted(object):
+    '''
+    Base class of the configuration objects. They use __slots__ instead of a __dict__ to keep the memory footprint
+    of large configurations small, this class makes them picklable. Attributes named in _transient_ are not pickled.
+    '''
+    __slots__ = ()
+    _transient_ = ()
+    
+    def __getstate__(self):
+        # a tuple with the values in the order of _state_names, the transient attributes are not in it
+        return(tuple([getattr(self, name, None) for name in _state_names(type(self))]))
+    
+    def __setstate__(self, state):
+        for (name, value) in zip(_state_names(type(self)), state):
+            object.__setattr__(self, name, value)
+        for name in self._transient_:
+            object.__setattr__(self, name, None)
+
+
+_StateNames = {}
+
+def _state_names(cls):
+    names = _StateNames.get(cls)
+    if names is None:
+        names = _StateNames[cls] = tuple(name for c in cls.__mro__ for name in getattr(c, '__slots__', ()) 
+                                         if name not in cls._transient_)
+    return(names)
+
+
+def _column_names(cls):
+    # the attributes that are stored as columns in a DeviceConfig snapshot, references to other objects are not
+    return(tuple(name for name in _state_names(cls) if name not in cls._references_))
+
+
+def _columns(cls, objects):
+    # the values of the attributes of the objects, a tuple per attribute
+    return(tuple(tuple(map(attrgetter(name), objects)) for name in _column_names(cls)))
+
+
+def _rebuild(cls, columns):
+    # creates the objects without __init__ and sets their attributes one column at a time, the loops run in C
+    objects = list(map(cls.__new__, repeat(cls, len(columns[0]))))
+    for (name, column) in zip(_column_names(cls), columns):
+        _assign(objects, name, column)
+    return(objects)
+
+
+def _assign(objects, name, values):
+    deque(map(setattr, objects, repeat(name), values), maxlen=0)
+
+
+class _PausedGC(object):
+    '''
+    Context manager that stops the cyclic garbage collector while a large object graph is built. Every few hundred
+    new objects trigger a collection that walks all the tracked objects, which makes building the graph of a large
+    configuration several times slower. The objects stay alive, so there is nothing to collect.
+    
+    The collector is process wide and graphs are built from many threads (GiraFleet, asyncio.to_thread), so the 
+    threads share one count: the first thread to enter disables the collector and the last one to leave restores 
+    the state it was in before.
+    '''
+    _lock = threading.Lock()
+    _paused = 0
+    _enabled = False
+    
+    def __enter__(self):
+        with _PausedGC._lock:
+            if _PausedGC._paused == 0:
+                _PausedGC._enabled = gc.isenabled()
+                gc.disable()
+            _PausedGC._paused += 1
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        with _PausedGC._lock:
+            _PausedGC._paused -= 1
+            if _PausedGC._paused == 0 and _PausedGC._enabled:
+                gc.enable()
+
+
+class Datapoint(_Slotted):
+    '''
+    Datapoint of a Function. The keys of the datapoint configuration are available as attributes, the common keys
+    are stored in slots and any other key in a (shared) dict.
+    
+    :param dp: datapoint configuration (dict)
+    '''
+    __slots__ = ('uid', 'name', 'canRead', 'canWrite', 'canEvent', '_value', 'updated', 'function', 'location',
+                 '_extra', '_subscriptions')
+    _config_keys_ = frozenset(('uid', 'name', 'canRead', 'canWrite', 'canEvent'))
+    _transient_ = ('_subscriptions', 'function')
+    _references_ = ()
+    
     def __init__(self, dp):
-        self.value = None
+        self._subscriptions = None
+        self._value = None
+        self.updated = None
         self.function = None
         self.location = None
+        self.name = self.canRead = self.canWrite = self.canEvent = None
+        self._extra = None
         
         for key in dp.keys():
-            setattr(self, key, dp[key])
-            if key == 'uid':
-                self.uid = dp[key]
+            if key in self._config_keys_:
+                setattr(self, key, dp[key])
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[sys.intern(key)] = dp[key]
+        
+        self.uid = sys.intern(dp['uid'])
+        if self.name is not None:
+            self.name = sys.intern(self.name)
+    
+    @property
+    def value(self):
+        '''
+        Last known value of the datapoint. Assigning a different value dispatches a change to the subscribers.
+        Every assignment sets updated to time.time().
+        '''
+        return(self._value)
+    
+    @value.setter
+    def value(self, value):
+        old = self._value
+        self._value = value
+        self.updated = time.time()
+        if self._subscriptions and value != old:
+            for subscription in self._subscriptions:
+                subscription.notify(self, old, value)
+    
+    def subscribe(self, handler, coalesce=None, loop=None):
+        '''
+        Subscribes a handler to the value changes of this datapoint (see gira.subscription).
+        
+        :param handler: callable or coroutine function that receives a gira.subscription.ValueChange.
+        :param coalesce: seconds to collect changes before only the last one is dispatched.
+        :param loop: event loop for a coroutine function handler, defaults to the running loop.
+        :returns: gira.subscription.Subscription, call its cancel method to unsubscribe.
+        '''
+        return(Subscription(handler, coalesce=coalesce, loop=loop).attach([self]))
+    
+    def _subscribe(self, subscription):
+        self._subscriptions = (self._subscriptions or ()) + (subscription,)
+    
+    def _unsubscribe(self, subscription):
+        self._subscriptions = tuple(s for s in self._subscriptions or () if s is not subscription) or None
+    
+    def __getattr__(self, name):
+        # only called for attributes that are not in a slot: the uncommon configuration keys
+        if not name.startswith('_') and self._extra and name in self._extra:
+            return(self._extra[name])
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
         
     def __repr__(self):
         return f"<Datapoint(name='{self.name}', uid='{self.uid}, value='{self.value}, function='{self.function}')>"
 
     def get(self):
         data = self.function.device.get_uid(self.uid)
-        if 'values' in data:
+        if inspect.isawaitable(data):
+            return(_update_async(self, data))
+        return(self._update(data))
+        
+    def _update(self, data):
+        if data and 'values' in data:
             for dp in data['values']:
                 self.value = dp['value']
                 log.debug(f"fetched: {self.uid} to {dp['value']} on {self}")
+        return(data)
                 
     def set(self,value):
-        return self.function.device.put_uid(self.uid, str(value))
+        '''
+        Sets the value of the datapoint on the device.
+        
+        :param value: data point value to be set
+        :returns: True of False, or a concurrent.futures.Future when the write scheduler of the device is enabled.
+        '''
+        device = self.function.device
+        if getattr(device, 'write_scheduler', None):
+            return device.schedule_put(self.uid, str(value))
+        return device.put_uid(self.uid, str(value))
+
+async def _update_async(obj, data):
+    return(obj._update(await data))
+
 
-class Function(object):
+class Function(_Slotted):
     '''
     Function takes a GiraServer object and the device configuration (dict) as an argument. A Function consist of
     the Function characteristics itself and the Datapoints
@@ -598,116 +1166,388 @@ class Function(object):
       },    
     '''
     
+    __slots__ = ('functionType', 'channelType', 'displayName', 'uid', 'dp_uids', 'location', 'trade', 'device')
+    _transient_ = ('device', 'location', 'trade')
+    _references_ = ('dp_uids',)
+    
     def __init__(self,config,device):
         '''
         
         '''
 
-        self.functionType = config['functionType']
-        self.channelType = config['channelType']
+        self.functionType = sys.intern(config['functionType'])
+        self.channelType = sys.intern(config['channelType'])
         self.displayName = config['displayName']
-        self.uid = config['uid']
+        self.uid = sys.intern(config['uid'])
         self.dp_uids = {}
         self.location = None
         self.proc_datapoints(config['dataPoints'])
         self.trade = None
         self.device = device
 
+    @property
+    def dataPoints(self):
+        '''
+        Tuple with the gira.device.Datapoint objects of the function.
+        '''
+        return(tuple(self.dp_uids.values()))
+
+    def subscribe(self, handler, coalesce=None, loop=None):
+        '''
+        Subscribes a handler to the value changes of all datapoints of this function (see gira.subscription).
+        
+        :param handler: callable or coroutine function that receives a gira.subscription.ValueChange.
+        :param coalesce: seconds to collect changes before only the last one of each datapoint is dispatched.
+        :param loop: event loop for a coroutine function handler, defaults to the running loop.
+        :returns: gira.subscription.Subscription, call its cancel method to unsubscribe.
+        '''
+        return(Subscription(handler, coalesce=coalesce, loop=loop).attach(self.dp_uids.values()))
+
     def __repr__(self):
         return f"<Function(functionType='{self.functionType}' channelType='{self.channelType}' displayName='{self.displayName}', " \
                         f"uid='{self.uid}')>"
     
     def get(self):
+        '''
+        Fetches the values of all datapoints of this function from the device.
+        
+        :returns: data dict or None if the device did not return the values. With a gira.aio.AsyncGiraServer 
+            as device an awaitable is returned.
+        '''
         data = self.device.get_uid(self.uid)
-        if 'values' in data:
+        if inspect.isawaitable(data):
+            return(_update_async(self, data))
+        return(self._update(data))
+        
+    def _update(self, data):
+        if data and 'values' in data:
+            debug = log.isEnabledFor(logging.DEBUG)
             for dp in data['values']:
-                self.dp_uids[dp['uid']].value = dp['value']
-                log.debug(f"fetched: {self.dp_uids[dp['uid']]} to {dp['value']}")
+                if dp['uid'] in self.dp_uids:
+                    self.dp_uids[dp['uid']].value = dp['value']
+                    if debug:
+                        log.debug(f"fetched: {self.dp_uids[dp['uid']]} to {dp['value']}")
+        return(data)
 
     def proc_datapoints(self,datapoints):
-        self.dataPoints = []
         for dp in datapoints:
             datapoint = Datapoint(dp)
-            self.dataPoints.append(datapoint)
             datapoint.function = self
             self.dp_uids[datapoint.uid] = datapoint
 
-class Location(object):
+class Location(_Slotted):
+    '''
+    Location (building, floor, room, ...) with its child locations. The full path of the location is computed once 
+    when it is created. DeviceConfig numbers the locations, the id is the index in DeviceConfig.location_ids.
+    
+    :param config: location configuration (dict)
+    :param parent: parent gira.device.Location or None
+    '''
+    __slots__ = ('displayName', 'locationType', 'children', 'functions', 'parent', 'uids', 'path', 'id', 'parent_id')
+    _transient_ = ('parent', 'uids')
+    _references_ = ('children',)
+    
     def __init__(self,config,parent=None):
         self.displayName = config['displayName']
-        self.locationType = config['locationType']
+        self.locationType = sys.intern(config['locationType'])
         self.children = []
         self.functions = None
         self.parent = parent
         self.uids = {}
+        self.id = self.parent_id = None
+        
+        if (parent):
+            self.path = f'{parent.path}/{self.displayName}({self.locationType})'
+        else:
+            self.path = f'{self.displayName} ({self.locationType})'
         
         if 'locations' in config.keys():
             for location in config['locations']:
                 self.children.append(Location(location,self))
         
         if 'functions' in config.keys():
-            self.functions = config['functions']
+            self.functions = tuple(sys.intern(uid) for uid in config['functions'])
             
+    def set_all(self, name, value):
+        '''
+        Sets the datapoint with the given name of every function in this location with a single batched put.
+        
+        :param name: name of the datapoint, e.g. 'OnOff' or 'Brightness'
+        :param value: data point value to be set
+        :returns: True of False
+        '''
+        return(_set_all(self.uids.values(), name, value))
+
     def location_string(self):
-        string = ""
-        if (self.parent):
-            string = f'{self.parent.location_string()}/{self.displayName}({self.locationType})'
-        else:
-            string = f'{self.displayName} ({self.locationType})'
-            
-        return(string)
+        return(self.path)
                 
     def __repr__(self):
         return f"<Location(displayName='{self.displayName}', locationType='{self.locationType}')>"
 
-class Trades(object):
+class Trades(_Slotted):
+    __slots__ = ('uids', 'tradeName', 'tradeType')
+    _references_ = ('uids',)
+    
     def __init__(self, config):
         self.uids = {}
         self.tradeName = config['displayName']
-        self.tradeType = config['tradeType']
+        self.tradeType = sys.intern(config['tradeType'])
         
     def tradestring(self):
         return(f'{self.tradeName}({self.tradeType})')
         
+    def set_all(self, name, value):
+        '''
+        Sets the datapoint with the given name of every function in this trade with a single batched put.
+        
+        :param name: name of the datapoint, e.g. 'OnOff' or 'Brightness'
+        :param value: data point value to be set
+        :returns: True of False
+        '''
+        return(_set_all(self.uids.values(), name, value))
+        
     def __repr__(self):
         return f"<Trades(tradeName='{self.tradeName}', tradeType='{self.tradeType}')>"
         
         
+def _index_keys(value, cls, key):
+    # translates Location/Trades objects in a select() criterion to their index keys
+    if value is None:
+        return(None)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return([key(v) if isinstance(v, cls) else v for v in value])
+    return(key(value) if isinstance(value, cls) else value)
+
+
+def _lookup(index, keys):
+    if isinstance(keys, (list, tuple, set, frozenset)):
+        return(set().union(*[index.get(key, ()) for key in keys]))
+    return(set(index.get(keys, ())))
+
+
+def _intersect(candidates):
+    if not candidates:
+        return(None)
+    candidates = sorted(candidates, key=len)
+    return(candidates[0].intersection(*candidates[1:]))
+
+
+def _set_all(functions, name, value):
+    values = {}
+    device = None
+    for function in functions:
+        for dp in function.dataPoints:
+            # canWrite is None when the configuration does not have the key, only an explicit false is read-only
+            if dp.name == name and dp.canWrite is not False:
+                values[dp.uid] = str(value)
+                device = function.device
+    
+    if not values:
+        log.debug(f'no writable datapoints named {name}')
+        device = next((function.device for function in functions), None)
+        # the callers of an AsyncGiraServer await the result
+        if device is not None and inspect.iscoroutinefunction(device.put_uids):
+            return(_result(True))
+        return(True)
+    
+    return(device.put_uids(values))
+
+
+async def _result(value):
+    return(value)
+
+        
+_SnapshotSkip = frozenset(('cache', 'device', '_device_config', 'locations', 'location_ids', 'function_uids', 
+                           'dataPiont_uids', 'uids', 'trades', 'functions_by_type', 'functions_by_channel', 
+                           'location_ids_by_path', 'functions_by_trade', 'datapoints_by_name', 'functions_within'))
+"""attributes of a DeviceConfig that are not pickled as they are, see DeviceConfig.__getstate__"""
+
+
 class DeviceConfig(object):
     '''
     This class is creating a device configuration based on the the cached device configuration.
     
     :param cache: gira.cache.CacheObject object
     :param device: gira.GiraServer object
+    :param device_config: configuration dict, when None it is loaded from the cache.
+    
+    The object graph can be saved with :meth:`DeviceConfig.snapshot` and restored with 
+    :meth:`DeviceConfig.from_snapshot` without processing the configuration again. GiraServer.get_device_config 
+    keeps a snapshot in the cache for the current configuration version.
+    
+    At load time indexes are built by functionType, channelType, datapoint name, location and trade, use 
+    :meth:`DeviceConfig.select` to query them.
+    
+    .. highlight:: python
+    .. code-block:: python
+    
+        >>> config.select(functionType='de.gira.schema.functions.KNX.Light', location=kitchen)
+        {'a015', 'a019', 'a01d'}
+        >>> config.select(name='Brightness', trade='Licht')
+        {'a004', 'a008', ...}
+        >>> config.select(functionType='de.gira.schema.functions.KNX.Light', within='Begane grond (Floor)')
+        {'a001', 'a005', ...}
+        
+    The location tree is also kept flattened: DeviceConfig.location_ids lists every location, the id and parent_id 
+    of a Location are indexes in that list, and DeviceConfig.location_ids_by_path maps the location_string() of a 
+    location to the ids of the locations with that path (sibling locations can share a name and type).
     '''
+    
+    SNAPSHOT_FORMAT = 9
+    """Version of the snapshot layout, increase it when the object model changes."""
 
-    def __init__(self, cache, device):
+    def __init__(self, cache, device, device_config=None):
 
         log.debug(f'started')
         self.cache = cache
         self.locations=[]
+        self.location_ids = []
         
         self.device = device
         
-        self.device_config = json.loads(self.cache.device_config_json)
+        with _PausedGC():
+            if device_config is None:
+                device_config = json.loads(self.cache.get_blob('device_config'))
+        
+            self._device_config = device_config
         
-        self.function_uids = {}
-        self.dataPiont_uids = {}
-        self.trades = []
+            self.function_uids = {}
+            self.dataPiont_uids = {}
+            self.trades = []
         
-        if 'functions' in self.device_config.keys():
-            self._proc_functions()
+            if 'functions' in self.device_config.keys():
+                self._proc_functions()
         
-        if 'locations' in self.device_config.keys():
-            self._proc_location()
+            if 'locations' in self.device_config.keys():
+                self._proc_location()
             
-        if 'trades' in self.device_config.keys():
-            self._proc_trades()
+            if 'trades' in self.device_config.keys():
+                self._proc_trades()
         
-        self.uids = {}
-        self.uids.update(self.function_uids)
-        self.uids.update(self.dataPiont_uids)
+            self.uids = {}
+            self.uids.update(self.function_uids)
+            self.uids.update(self.dataPiont_uids)
+        
+            self._build_indexes()
+        
+        # the object graph holds everything, the raw configuration is loaded from the cache when it is requested.
+        self._device_config = None
+        
+    @property
+    def device_config(self):
+        '''
+        The raw configuration (dict). It is not kept in memory after the construction, the first access loads it 
+        from the cache and keeps it. None when there is no cache.
+        '''
+        if self._device_config is None and self.cache is not None:
+            blob = self.cache.get_blob('device_config')
+            self._device_config = json.loads(blob) if blob else None
+        
+        return(self._device_config)
+
+    def __getstate__(self):
+        # the objects are stored per class in columns (a tuple per attribute) and the references between them as 
+        # positions, so they are restored in bulk instead of with a __setstate__ call per object. The indexes are
+        # built again, that is faster than unpickling their sets.
+        state = {name: value for (name, value) in self.__dict__.items() if name not in _SnapshotSkip}
+        
+        functions = list(self.function_uids.values())
+        datapoints = [dp for function in functions for dp in function.dp_uids.values()]
+        trade_ids = {id(trade): i for (i, trade) in enumerate(self.trades)}
+        
+        state['_columns'] = {
+            'functions': _columns(Function, functions),
+            'datapoints': _columns(Datapoint, datapoints),
+            'locations': _columns(Location, self.location_ids),
+            'trades': _columns(Trades, self.trades),
+            'function_datapoints': tuple(len(function.dp_uids) for function in functions),
+            'function_locations': tuple(function.location.id if function.location else None 
+                                        for function in functions),
+            'function_trades': tuple(trade_ids[id(function.trade)] if function.trade else None 
+                                     for function in functions),
+            'trade_functions': tuple(tuple(trade.uids) for trade in self.trades),
+            }
+        return(state)
+
+    def __setstate__(self, state):
+        columns = state.pop('_columns')
+        self.__dict__.update(state)
+        self.cache = self.device = self._device_config = None
+        
+        with _PausedGC():
+            self._restore(columns)
+            self._build_indexes()
+
+    def _restore(self, columns):
+        functions = _rebuild(Function, columns['functions'])
+        datapoints = _rebuild(Datapoint, columns['datapoints'])
+        locations = _rebuild(Location, columns['locations'])
+        trades = _rebuild(Trades, columns['trades'])
+        
+        self.function_uids = dict(zip(map(attrgetter('uid'), functions), functions))
+        self.dataPiont_uids = dict(zip(map(attrgetter('uid'), datapoints), datapoints))
+        self.uids = {**self.function_uids, **self.dataPiont_uids}
+        
+        # the datapoints are stored function by function
+        counts = columns['function_datapoints']
+        (uids, objects) = (map(attrgetter('uid'), datapoints), iter(datapoints))
+        _assign(functions, 'dp_uids', [dict(zip(islice(uids, count), islice(objects, count))) for count in counts])
+        _assign(functions, 'device', repeat(None))
+        _assign(datapoints, 'function', chain.from_iterable(map(repeat, functions, counts)))
+        _assign(datapoints, '_subscriptions', repeat(None))
+        
+        by_id = dict(enumerate(locations))
+        by_id[None] = None
+        parent_ids = tuple(map(attrgetter('parent_id'), locations))
+        _assign(functions, 'location', map(by_id.__getitem__, columns['function_locations']))
+        _assign(locations, 'parent', map(by_id.__getitem__, parent_ids))
+        _assign(locations, 'uids', 
+                [dict(zip(uids, map(self.function_uids.__getitem__, uids))) if uids else {} 
+                 for uids in map(attrgetter('functions'), locations)])
+        
+        # children have a higher id than their parent, in id order they are appended in their original order
+        children = [[] for location in locations]
+        for (location, parent_id) in zip(locations, parent_ids):
+            if parent_id is not None:
+                children[parent_id].append(location)
+        _assign(locations, 'children', children)
+        
+        by_id = dict(enumerate(trades))
+        by_id[None] = None
+        _assign(functions, 'trade', map(by_id.__getitem__, columns['function_trades']))
+        _assign(trades, 'uids', [dict(zip(uids, map(self.function_uids.__getitem__, uids))) 
+                                 for uids in columns['trade_functions']])
+        
+        self.location_ids = locations
+        self.locations = [location for (location, parent_id) in zip(locations, parent_ids) if parent_id is None]
+        self.trades = trades
+
+    def snapshot(self):
+        """
+        Serializes the object graph (functions, datapoints, locations and trades) without the cache and device 
+        objects. The objects are stored per class in columns, the indexes are built again when it is restored.
         
+        :returns: bytes
+        """
+        with _PausedGC():
+            return(pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, cache, device):
+        """
+        Restores a DeviceConfig from a snapshot and attaches it to the cache and device. The snapshot is unpickled, 
+        only load snapshots from a trusted cache.
+        
+        :param snapshot: bytes returned by DeviceConfig.snapshot
+        :param cache: gira.cache.CacheObject object
+        :param device: gira.GiraServer object
+        """
+        with _PausedGC():
+            config = pickle.loads(snapshot)
+        config.cache = cache
+        config.device = device
+        _assign(config.function_uids.values(), 'device', repeat(device))
+        return(config)
 
     def uid(self,uid):
         """
@@ -718,12 +1558,218 @@ class DeviceConfig(object):
         return self.uids[uid]
 
 
-    def get_all (self):
+    def location(self, path):
         """
-        Fetch all gira.device.Datapoint values from the X1 server
-                """
-        for function_uid in self.function_uids:
-            self.function_uids[function_uid].get()
+        returns the gira.device.Location with the given location_string().
+        
+        :param path: location_string() of the location, e.g. 'Begane grond (Floor)/keuken(Room)'
+        :raises KeyError: when there is no location with this path.
+        :raises ValueError: when sibling locations share this path, use location_ids_by_path to get all of them.
+        """
+        ids = self.location_ids_by_path[path]
+        if len(ids) > 1:
+            raise ValueError(f'{len(ids)} locations have the path {path!r}, see DeviceConfig.location_ids_by_path')
+        return self.location_ids[ids[0]]
+
+    def functions_under(self, location):
+        """
+        returns the uids of the functions in a location and all its descendant locations.
+        
+        :param location: gira.device.Location object or its location_string()
+        """
+        return(self._locations(location, subtree=True))
+
+    def select(self, functionType=None, channelType=None, name=None, location=None, trade=None, within=None):
+        """
+        Returns the uids that match all of the given criteria. Every criterion can be a single value or a list of 
+        values, a list matches any of its values. The result is a set, so results can be combined with the set 
+        operators.
+        
+        :param functionType: functionType of the function, e.g. 'de.gira.schema.functions.KNX.Light'
+        :param channelType: channelType of the function, e.g. 'de.gira.schema.channels.KNX.Dimmer'
+        :param name: name of the datapoint, e.g. 'Brightness'. When given datapoint uids are returned.
+        :param location: gira.device.Location object or its location_string(), a location_string() shared by sibling 
+            locations with the same name and type matches all of them.
+        :param trade: gira.device.Trades object or its tradeName, e.g. 'Licht'
+        :param within: like location, but also matches the functions in all descendant locations.
+        :returns: set of function uids, or set of datapoint uids when name is given.
+        """
+        criteria = [(self.functions_by_type, functionType),
+                    (self.functions_by_channel, channelType),
+                    (self.functions_by_trade, _index_keys(trade, Trades, lambda trade: trade.tradeName))]
+        
+        candidates = [_lookup(index, keys) for (index, keys) in criteria if keys is not None]
+        if location is not None:
+            candidates.append(self._locations(location, subtree=False))
+        if within is not None:
+            candidates.append(self._locations(within, subtree=True))
+        functions = _intersect(candidates)
+        
+        if name is None:
+            return(functions if functions is not None else set(self.function_uids))
+        
+        datapoints = _lookup(self.datapoints_by_name, name)
+        if functions is None:
+            return(datapoints)
+        
+        if len(functions) < len(datapoints):
+            return({uid for function_uid in functions for uid in self.function_uids[function_uid].dp_uids 
+                    if uid in datapoints})
+        return({uid for uid in datapoints if self.dataPiont_uids[uid].function.uid in functions})
+
+    def subscribe(self, handler, uid=None, coalesce=None, loop=None, **criteria):
+        """
+        Subscribes a handler to the value changes of the selected datapoints (see gira.subscription). Without uid 
+        and criteria the handler is subscribed to all datapoints.
+        
+        .. highlight:: python
+        .. code-block:: python
+        
+            config.subscribe(handler, trade='Licht', name='OnOff')
+            config.subscribe(handler, uid=['a001', 'a00h'], coalesce=0.5)
+        
+        :param handler: callable or coroutine function that receives a gira.subscription.ValueChange.
+        :param uid: uid or list of uids of datapoints or functions, a function uid selects all its datapoints.
+        :param coalesce: seconds to collect changes before only the last one of each datapoint is dispatched.
+        :param loop: event loop for a coroutine function handler, defaults to the running loop.
+        :param criteria: functionType, channelType, name, location, trade and within as in DeviceConfig.select.
+        :returns: gira.subscription.Subscription, call its cancel method to unsubscribe.
+        """
+        datapoints = self._datapoints(self.select(**criteria))
+        if uid is not None:
+            selected = self._datapoints(uid if isinstance(uid, (list, tuple, set, frozenset)) else [uid])
+            datapoints = {uid: dp for (uid, dp) in datapoints.items() if uid in selected}
+        
+        log.debug(f'subscribing {handler} to {len(datapoints)} datapoints')
+        return(Subscription(handler, coalesce=coalesce, loop=loop).attach(datapoints.values()))
+
+    def _locations(self, locations, subtree):
+        # a Location object selects only itself, a location_string() every location with that path
+        if not isinstance(locations, (list, tuple, set, frozenset)):
+            locations = [locations]
+        
+        functions = set()
+        for location in locations:
+            ids = [location.id] if isinstance(location, Location) else self.location_ids_by_path.get(location, ())
+            for id in ids:
+                functions |= self.functions_within[id] if subtree else self.location_ids[id].uids.keys()
+        return(functions)
+
+    def stale(self, max_age):
+        '''
+        Returns the datapoints whose value was not updated in the last max_age seconds, including the datapoints 
+        that never received a value.
+        
+        :param max_age: seconds
+        :returns: list of gira.device.Datapoint objects.
+        '''
+        oldest = time.time() - max_age
+        return([dp for dp in self.dataPiont_uids.values() if dp.updated is None or dp.updated < oldest])
+
+    def _datapoints(self, uids):
+        # expands function uids to their datapoints
+        datapoints = {}
+        for uid in uids:
+            obj = self.uids.get(uid)
+            if isinstance(obj, Function):
+                datapoints.update(obj.dp_uids)
+            elif obj is not None:
+                datapoints[uid] = obj
+        return(datapoints)
+
+    def _build_indexes(self):
+        self.functions_by_type = {}
+        self.functions_by_channel = {}
+        self.location_ids_by_path = {}
+        self.functions_by_trade = {}
+        self.datapoints_by_name = {}
+        
+        for function in self.function_uids.values():
+            self.functions_by_type.setdefault(function.functionType, set()).add(function.uid)
+            self.functions_by_channel.setdefault(function.channelType, set()).add(function.uid)
+            if function.trade:
+                self.functions_by_trade.setdefault(function.trade.tradeName, set()).add(function.uid)
+        
+        for dp in self.dataPiont_uids.values():
+            self.datapoints_by_name.setdefault(dp.name, set()).add(dp.uid)
+        
+        # sibling locations can share a name and type, and so their path
+        for location in self.location_ids:
+            self.location_ids_by_path.setdefault(location.path, []).append(location.id)
+        
+        # children have a higher id than their parent, walking backwards collects each subtree before its parent
+        within = [set(location.uids) for location in self.location_ids]
+        for location in reversed(self.location_ids):
+            if location.parent_id is not None:
+                within[location.parent_id] |= within[location.id]
+        
+        self.functions_within = within
+        """list with per location id the uids of the functions in the location and all its descendants"""
+
+    def get_all (self, concurrency=1):
+        """
+        Fetch all gira.device.Datapoint values from the X1 server. A failing function does not stop the others 
+        from being fetched, the failures are returned per uid.
+        
+        With concurrency > 1 the functions are fetched by a bounded pool of worker threads that share the pooled 
+        http session of the GiraServer, so keep concurrency at or below its pool_maxsize.
+        
+        With a gira.aio.AsyncGiraServer as device an awaitable is returned and the requests are run on the event
+        loop, at most concurrency at the same time.
+        
+        :param concurrency: number of requests in flight at the same time.
+        :returns: tuple (results, errors), results maps the function uid to the data returned by the device and 
+            errors maps the function uid to the reason it could not be fetched.
+        """
+        if inspect.iscoroutinefunction(self.device.get_uid):
+            return(self._get_all_async(concurrency))
+        
+        def fetch(function):
+            try:
+                return(function.get(), None)
+            except Exception as e:
+                return(None, e)
+        
+        functions = list(self.function_uids.values())
+        if (concurrency > 1):
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(fetch, functions))
+        else:
+            outcomes = [fetch(function) for function in functions]
+        
+        return(self._collect(functions, outcomes))
+        
+    async def _get_all_async(self, concurrency):
+        import asyncio
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        
+        async def fetch(function):
+            async with semaphore:
+                try:
+                    return(await function.get(), None)
+                except Exception as e:
+                    return(None, e)
+        
+        functions = list(self.function_uids.values())
+        outcomes = await asyncio.gather(*[fetch(function) for function in functions])
+        return(self._collect(functions, outcomes))
+        
+    def _collect(self, functions, outcomes):
+        results = {}
+        errors = {}
+        
+        for (function, (data, error)) in zip(functions, outcomes):
+            if error is not None:
+                errors[function.uid] = f'{type(error).__name__}: {error}'
+            elif not data or 'values' not in data:
+                errors[function.uid] = 'no values received'
+            else:
+                results[function.uid] = data
+        
+        if errors:
+            log.error(f'fetching {len(errors)} of {len(functions)} functions failed')
+        
+        return(results, errors)
 
     def update_uid (self,uid,data):
         """
@@ -737,37 +1783,38 @@ class DeviceConfig(object):
         
     def _proc_location(self):
         log.debug(f'started')
+        # the messages are only formatted when they are logged, formatting them costs more than the rest of the loop
+        debug = log.isEnabledFor(logging.DEBUG)
         for  location in self.device_config['locations']:
             location = Location(location)
             self.locations.append(location)
-
             
-            def set_location(self,location):
+            stack = [location]
+            while stack:
+                location = stack.pop()
+                location.id = len(self.location_ids)
+                location.parent_id = location.parent.id if location.parent else None
+                self.location_ids.append(location)
+                
                 if location.functions:
                     for uid in location.functions:
                         function = self.function_uids[uid]
                         function.location = location
                         location.uids[uid] = function
-
-                for loc in location.children:
-                    set_location(self,loc)
-                    
-                log.debug (f'location added: {location}')
                 
-            log.debug (f'location added: {location}')
-            if location.functions:
-                set_location(self,location)
+                stack.extend(reversed(location.children))
                 
-            for loc in location.children:
-                set_location(self,loc)
+            if debug:
+                log.debug (f'location added: {location}')
 
     def _proc_trades(self):
         log.debug(f'started')
-        
+        debug = log.isEnabledFor(logging.DEBUG)
         
         for trades_conf in self.device_config['trades']:
             trade = Trades(trades_conf)
-            log.debug (f'trade added: {trade}')
+            if debug:
+                log.debug (f'trade added: {trade}')
             
             if 'functions' in trades_conf:
                 for uid in trades_conf['functions']:
@@ -780,10 +1827,12 @@ class DeviceConfig(object):
         
     def _proc_functions(self):
         log.debug(f'started')
+        debug = log.isEnabledFor(logging.DEBUG)
         
         for  function in self.device_config['functions']:
             function = Function(function, self.device)
-            log.debug (f'function added: {function}')
+            if debug:
+                log.debug (f'function added: {function}')
             self.function_uids[function.uid] = function
             for dp in function.dataPoints:
                 self.dataPiont_uids[dp.uid] = dp
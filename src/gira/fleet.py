@@ -0,0 +1,316 @@
+"""Module to manage the X1/Homeservers of many sites from one process.
+
+A :class:`GiraFleet` holds a :class:`gira.device.GiraServer` per site, each with its own
+:class:`gira.cache.CacheObject` instance, and runs the fleet wide operations (connect, refresh the configuration,
+get_all and setting or deleting the callbacks) for all sites in parallel. A site that fails or raises does not
+affect the others, every operation returns a :class:`FleetResult` with the outcome and duration per site, so a
+fleet wide refresh takes about as long as the slowest site instead of the sum of all of them.
+
+Every site needs a cache database. Sites that share one also share its connections, so a shared sqlite database
+limits how many sites run in parallel, a file per site or a server database does not.
+
+Operations on the same site are serialized, and get_all fetches at most site_concurrency functions of a site at the
+same time, so a site never has more than site_concurrency requests in flight.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.fleet import GiraFleet
+    >>> fleet = GiraFleet(max_workers=16, site_concurrency=4)
+    >>> for site in sites:
+    ...     fleet.add_site(site['name'], site['hostname'], site['username'], site['password'], dburi=DBURI)
+    >>> fleet.connect().summary()
+    'connect: 60/60 sites ok in 0.84 s (slowest site-17 0.81 s, sum of all sites 21.30 s)'
+    >>> result = fleet.refresh_config(refresh='auto')
+    >>> result.failed
+    {'site-42': 'ConnectionError: ...'}
+    >>> (values, errors) = fleet.get_all()['site-01'].result
+    >>> fleet.set_callbacks('https://callbacks.example.com/{site}/function', 'https://callbacks.example.com/{site}/value')
+
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+SiteResult = namedtuple('SiteResult', ['site', 'ok', 'result', 'error', 'duration'])
+"""Outcome of an operation on one site: site name, True when it succeeded, the return value of the operation, the
+reason it failed (or None) and the duration in seconds"""
+
+
+class FleetResult(object):
+    '''
+    Outcome of a fleet wide operation.
+
+    :param operation: name of the operation.
+    :param results: list of gira.fleet.SiteResult objects.
+    :param duration: wall clock duration of the operation in seconds.
+    '''
+
+    def __init__(self, operation, results, duration):
+        self.operation = operation
+        self.results = {result.site: result for result in results}
+        """dict with per site a gira.fleet.SiteResult"""
+        self.duration = duration
+
+    def __getitem__(self, site):
+        return(self.results[site])
+
+    def __iter__(self):
+        return(iter(self.results.values()))
+
+    def __len__(self):
+        return(len(self.results))
+
+    @property
+    def ok(self):
+        '''
+        dict with the return value per site that succeeded
+        '''
+        return({site: result.result for (site, result) in self.results.items() if result.ok})
+
+    @property
+    def failed(self):
+        '''
+        dict with the reason per site that failed
+        '''
+        return({site: result.error for (site, result) in self.results.items() if not result.ok})
+
+    @property
+    def total(self):
+        '''
+        sum of the durations of all sites in seconds, the time the operation would take site by site
+        '''
+        return(sum(result.duration for result in self.results.values()))
+
+    @property
+    def slowest(self):
+        '''
+        gira.fleet.SiteResult of the site that took the longest or None when there are no sites
+        '''
+        return(max(self.results.values(), key=lambda result: result.duration, default=None))
+
+    def summary(self):
+        '''
+        Returns a one line description of the outcome and timing.
+        '''
+        text = f'{self.operation}: {len(self.ok)}/{len(self.results)} sites ok in {self.duration:.2f} s'
+        slowest = self.slowest
+        if slowest:
+            text += f' (slowest {slowest.site} {slowest.duration:.2f} s, sum of all sites {self.total:.2f} s)'
+        return(text)
+
+    def __repr__(self):
+        return(f'<FleetResult({self.summary()})>')
+
+
+class GiraFleet(object):
+    '''
+    Runs operations on many GiraServer objects in parallel.
+
+    :param max_workers: number of sites handled at the same time.
+    :param site_concurrency: maximum number of requests in flight per site, the concurrency of get_all. Keep it at
+        or below the pool_maxsize of the servers.
+    '''
+
+    def __init__(self, max_workers=16, site_concurrency=4):
+        self.max_workers = max_workers
+        self.site_concurrency = site_concurrency
+        self.servers = {}
+        """dict with per site the gira.device.GiraServer"""
+        self.configs = {}
+        """dict with per site the gira.device.DeviceConfig of the last successful refresh_config"""
+        self.concurrency = {}
+        self._site_locks = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return(len(self.servers))
+
+    def add(self, site, server, concurrency=None):
+        '''
+        Adds the server of a site.
+
+        :param site: name of the site.
+        :param server: gira.device.GiraServer object, preferably constructed with lazy=True.
+        :param concurrency: maximum number of requests in flight for this site, defaults to site_concurrency.
+        :returns: the server.
+        '''
+        with self._lock:
+            self.servers[site] = server
+            self.concurrency[site] = concurrency or self.site_concurrency
+            self._site_locks[site] = threading.Lock()
+        return(server)
+
+    def add_site(self, site, hostname, username, password, dburi, cache_options=None,
+                 concurrency=None, **kwargs):
+        '''
+        Creates a lazy GiraServer with a CacheObject named after the site and adds it. Nothing is sent to the
+        device until an operation needs it.
+
+        :param site: name of the site, also the instance name of the cache.
+        :param hostname: Hostname of the X1 or Home server
+        :param username: Gira Server (X1 or Home server) username
+        :param password: Gira Server (X1 or Home server) password
+        :param dburi: database uri of the cache, the sites are separate instances of it. Sites that share a database
+            share its connections, an in-memory sqlite database has a single connection that serializes the cache
+            access of all its sites (and is lost when the process ends), so use a file per site or a server database
+            to run the sites in parallel and keep the cookie, token and configuration across restarts.
+        :param cache_options: dict with extra arguments for gira.cache.CacheObject.
+        :param concurrency: maximum number of requests in flight for this site, defaults to site_concurrency.
+        :param kwargs: extra arguments for gira.device.GiraServer (vpn, gira_username, timeout, ...).
+        :returns: the server.
+        '''
+        from gira.cache import CacheObject
+        from gira.device import GiraServer
+
+        cache = CacheObject(dburi=dburi, instance=site, **(cache_options or {}))
+        kwargs.setdefault('lazy', True)
+        return(self.add(site, GiraServer(hostname, username, password, cache, **kwargs), concurrency))
+
+    def remove(self, site):
+        '''
+        Removes a site from the fleet, the server is not closed.
+
+        :returns: the server or None
+        '''
+        with self._lock:
+            self.configs.pop(site, None)
+            self.concurrency.pop(site, None)
+            self._site_locks.pop(site, None)
+            return(self.servers.pop(site, None))
+
+    def close(self):
+        '''
+        Closes all servers (flushing their caches) and stops the worker threads.
+        '''
+        self.run('close', lambda site, server: server.close() or True)
+
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+    def run(self, operation, function, sites=None):
+        '''
+        Runs function(site, server) for the sites in parallel. A site fails when the function raises or returns
+        False or None, the other sites are not affected.
+
+        :param operation: name of the operation, used in the result and the log.
+        :param function: callable with the site name and the server as arguments.
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object
+        '''
+        sites = list(self.servers) if sites is None else list(sites)
+
+        with self._lock:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gira-fleet')
+            executor = self._executor
+
+        start = time.perf_counter()
+        results = list(executor.map(lambda site: self._run_site(operation, function, site), sites))
+        result = FleetResult(operation, results, time.perf_counter() - start)
+
+        if result.failed:
+            log.error(f'{operation} failed for {len(result.failed)} of {len(result)} sites: {sorted(result.failed)}')
+        log.info(result.summary())
+        return(result)
+
+    def _run_site(self, operation, function, site):
+        start = time.perf_counter()
+        try:
+            server = self.servers[site]
+            with self._site_locks[site]:
+                outcome = function(site, server)
+        except Exception as e:
+            log.debug(f'{operation} {site}: {type(e).__name__}: {e}')
+            return(SiteResult(site, False, None, f'{type(e).__name__}: {e}', time.perf_counter() - start))
+
+        duration = time.perf_counter() - start
+        if outcome is False or outcome is None:
+            return(SiteResult(site, False, outcome, f'{operation} returned {outcome}', duration))
+        return(SiteResult(site, True, outcome, None, duration))
+
+    def connect(self, refresh=False, sites=None):
+        '''
+        Logs in to the VPN, fetches the identity and authenticates every site (see GiraServer.connect).
+
+        :param refresh: boolean if True the cached cookie, identity and token are fetched again.
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object with the token per site
+        '''
+        return(self.run('connect', lambda site, server: server.connect(refresh=refresh), sites))
+
+    def refresh_config(self, refresh=True, sites=None):
+        '''
+        Fetches the device configuration of every site (see GiraServer.get_device_config), the configurations are
+        kept in GiraFleet.configs.
+
+        :param refresh: True fetches the configuration, 'auto' only when its uid changed, False uses the cache.
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object with the DeviceConfig per site
+        '''
+        def refresh_site(site, server):
+            config = server.get_device_config(refresh=refresh)
+            if config:
+                self.configs[site] = config
+            return(config)
+
+        return(self.run('refresh_config', refresh_site, sites))
+
+    def get_all(self, sites=None):
+        '''
+        Fetches all datapoint values of every site, at most the concurrency of the site at the same time (see
+        DeviceConfig.get_all). The configuration is loaded (from the cache when possible) when the site does not
+        have one yet.
+
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object with the (results, errors) tuple of DeviceConfig.get_all per site
+        '''
+        def get_all_site(site, server):
+            config = self.configs.get(site)
+            if not config:
+                config = server.get_device_config()
+                if not config:
+                    return(False)
+                self.configs[site] = config
+            return(config.get_all(concurrency=self.concurrency[site]))
+
+        return(self.run('get_all', get_all_site, sites))
+
+    def set_callbacks(self, serviceCallback, valueCallback, testCallbacks=True, sites=None):
+        '''
+        Registers the callbacks of every site (see GiraServer.set_callaback).
+
+        :param serviceCallback: Callback url for service callback's, {site} is replaced by the name of the site.
+        :param valueCallback: Callback url for datapoint callback's, {site} is replaced by the name of the site.
+        :param testCallbacks: Test the callback server.
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object
+        '''
+        return(self.run('set_callbacks',
+                        lambda site, server: server.set_callaback(serviceCallback.replace('{site}', site),
+                                                                  valueCallback.replace('{site}', site),
+                                                                  testCallbacks=testCallbacks),
+                        sites))
+
+    def delete_callbacks(self, sites=None):
+        '''
+        Deletes the callbacks of every site (see GiraServer.delete_callback).
+
+        :param sites: iterable of site names, defaults to all sites.
+        :returns: gira.fleet.FleetResult object
+        '''
+        return(self.run('delete_callbacks', lambda site, server: server.delete_callback(), sites))
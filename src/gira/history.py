@@ -0,0 +1,220 @@
+"""Module to keep a recent history of datapoint values.
+
+The :class:`EventLog` is an append-only ring buffer of (timestamp, uid, value) records in a memory-mapped file of a
+fixed size, one file per instance. When the file is full the oldest records are overwritten. An in-memory index per
+uid makes range queries cheap, and :meth:`EventLog.replay` restores the last known values of a
+:class:`gira.device.DeviceConfig` after a restart.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.history import EventLog
+    >>> history = EventLog('/var/lib/gira/x1-home.events', capacity=1000000)
+    >>> history.subscribe(config)
+    >>> history.query('a00h', start=time.time() - 86400)
+    [(1668956400.12, 'a00h', '21.5'), ...]
+    >>> history.replay(config)
+
+Uids are stored in at most 16 bytes and values in at most 32 bytes (utf-8), longer uids and values are truncated.
+A truncated uid is also the key of its records in the index and in query, last and replay.
+
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+log = logging.getLogger(__name__)
+
+_MAGIC = b'GIRAEVT1'
+_HEADER = struct.Struct('<8sQQ')
+"""magic, capacity, number of records ever written"""
+_RECORD = struct.Struct('<d16s32s')
+"""timestamp, uid, value"""
+
+
+class EventLog(object):
+    '''
+    Fixed size ring buffer of datapoint values in a memory-mapped file.
+
+    :param path: file name, the file is created when it does not exist.
+    :param capacity: number of records the file holds, ignored when the file exists.
+    '''
+
+    def __init__(self, path, capacity=100000):
+        self.path = path
+        self.lock = threading.Lock()
+
+        exists = os.path.exists(path) and os.path.getsize(path) >= _HEADER.size
+        self.file = open(path, 'r+b' if exists else 'w+b')
+
+        if exists:
+            (magic, capacity, written) = _HEADER.unpack(self.file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f'{path} is not an event log')
+        else:
+            written = 0
+            self.file.truncate(_HEADER.size + capacity * _RECORD.size)
+
+        self.capacity = capacity
+        self.written = written
+        self.map = mmap.mmap(self.file.fileno(), _HEADER.size + capacity * _RECORD.size)
+        self._write_header()
+
+        self.index = {}
+        """dict with per uid the list of the sequence numbers of its records, in order. The first ones can be 
+        overwritten already, see _stale"""
+        self._stale = {}
+        """dict with per uid the number of sequence numbers at the front of its index list that were overwritten"""
+        self._build_index()
+
+        log.debug(f'opened {path}: {len(self)} of {capacity} records')
+
+    def __len__(self):
+        return(min(self.written, self.capacity))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Writes the buffer to disk and closes the file.
+        '''
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+    def flush(self):
+        '''
+        Writes the buffer to disk.
+        '''
+        self.map.flush()
+
+    def append(self, uid, value, timestamp=None):
+        '''
+        Appends a record, overwriting the oldest record when the log is full.
+
+        :param uid: uid from the data point.
+        :param value: data point value.
+        :param timestamp: time.time() of the event, defaults to now.
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+
+        uid = _key(uid)
+        record = _RECORD.pack(timestamp, uid.encode(), str(value).encode()[:32])
+
+        with self.lock:
+            sequence = self.written
+            offset = _HEADER.size + (sequence % self.capacity) * _RECORD.size
+
+            if sequence >= self.capacity:
+                self._forget(offset)
+
+            self.map[offset:offset + _RECORD.size] = record
+            self.written = sequence + 1
+            self._write_header()
+            self.index.setdefault(uid, []).append(sequence)
+
+    def query(self, uid, start=None, end=None):
+        '''
+        Returns the records of a uid between start and end.
+
+        :param uid: uid from the data point.
+        :param start: time.time() of the oldest record to return, defaults to the oldest record.
+        :param end: time.time() of the newest record to return, defaults to the newest record.
+        :returns: list of (timestamp, uid, value) tuples, oldest first.
+        '''
+        uid = _key(uid)
+        with self.lock:
+            sequences = self.index.get(uid, [])
+            live = self._stale.get(uid, 0)
+            # records of one uid are appended in time order, so a binary search on the timestamps finds the range
+            first = bisect_left(sequences, start, lo=live, key=self._timestamp) if start is not None else live
+            last = bisect_right(sequences, end, lo=first, key=self._timestamp) if end is not None else len(sequences)
+            return([self._read(sequence) for sequence in sequences[first:last]])
+
+    def last(self, uid):
+        '''
+        Returns the newest record of a uid or None.
+        '''
+        with self.lock:
+            sequences = self.index.get(_key(uid))
+            return(self._read(sequences[-1]) if sequences else None)
+
+    def replay(self, config):
+        '''
+        Sets the value of every datapoint of the configuration that is in the log to its last logged value, and
+        updated to the time it was logged. The subscribers are not notified, so a subscribed log does not log the
+        restored values again.
+
+        :param config: gira.device.DeviceConfig object
+        :returns: number of datapoints restored.
+        '''
+        restored = 0
+        for dp in config.dataPiont_uids.values():
+            record = self.last(dp.uid)
+            if record:
+                dp._value = record[2]
+                dp.updated = record[0]
+                restored += 1
+
+        log.info(f'restored {restored} datapoint values from {self.path}')
+        return(restored)
+
+    def subscribe(self, config, **criteria):
+        '''
+        Logs every value change of the (selected) datapoints of the configuration.
+
+        :param config: gira.device.DeviceConfig object
+        :param criteria: selection as in DeviceConfig.subscribe.
+        :returns: gira.subscription.Subscription object
+        '''
+        return(config.subscribe(lambda change: self.append(change.uid, change.new), **criteria))
+
+    def _write_header(self):
+        self.map[0:_HEADER.size] = _HEADER.pack(_MAGIC, self.capacity, self.written)
+
+    def _timestamp(self, sequence):
+        return(struct.unpack_from('<d', self.map, _HEADER.size + (sequence % self.capacity) * _RECORD.size)[0])
+
+    def _read(self, sequence):
+        offset = _HEADER.size + (sequence % self.capacity) * _RECORD.size
+        (timestamp, uid, value) = _RECORD.unpack_from(self.map, offset)
+        return((timestamp, uid.rstrip(b'\0').decode(), value.rstrip(b'\0').decode(errors='replace')))
+
+    def _forget(self, offset):
+        # the oldest record of its uid is about to be overwritten
+        uid = _RECORD.unpack_from(self.map, offset)[1].rstrip(b'\0').decode()
+        sequences = self.index.get(uid)
+        if sequences:
+            # removing the front of a list is O(n), the overwritten sequences are removed in batches instead
+            stale = self._stale.get(uid, 0) + 1
+            if stale * 2 >= len(sequences):
+                del sequences[:stale]
+                stale = 0
+                if not sequences:
+                    del self.index[uid]
+            if stale:
+                self._stale[uid] = stale
+            else:
+                self._stale.pop(uid, None)
+
+    def _build_index(self):
+        for sequence in range(max(self.written - self.capacity, 0), self.written):
+            offset = _HEADER.size + (sequence % self.capacity) * _RECORD.size
+            uid = _RECORD.unpack_from(self.map, offset)[1].rstrip(b'\0').decode()
+            self.index.setdefault(uid, []).append(sequence)
+
+
+def _key(uid):
+    # the uid as it is stored in a record, at most 16 bytes without splitting a utf-8 character
+    return(uid.encode()[:16].decode(errors='ignore'))
@@ -0,0 +1,279 @@
+"""Module to measure where the time of the requests to the X1/Homeserver goes.
+
+Every :class:`gira.device.GiraServer` and :class:`gira.aio.AsyncGiraServer` has an :class:`Instrumentation`
+object, an event bus that calls the registered hooks on every request and on every database lookup of the cache.
+Without hooks nothing is measured.
+
+======================  ==============================================================================
+event                   hook arguments
+======================  ==============================================================================
+request_start           :data:`RequestStart`
+request_end             :data:`RequestEnd`
+cache_lookup            key, hit (True when the value was in the database), duration in seconds
+cache_write             key, duration in seconds
+reauthenticate          the refused token
+vpn_login               True when the login succeeded, duration in seconds
+======================  ==============================================================================
+
+The endpoint of a request is the name of its url in :data:`gira.device.DeviceTypes` (e.g. `GET_UID` or
+`CONFIG_URL`), `IDENTITY` for the identity url, `VPN_PORTAL` for the login form and the credentials posted to
+the Gira VPN portal, `VPN_CONNECT` for the renewal of the VPN cookie and `OTHER` for anything else.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.instrument import HistogramCollector
+    >>> server.instrumentation.on('request_end', lambda event: print(event.endpoint, event.status, event.duration))
+    >>> collector = HistogramCollector().attach(server.instrumentation)
+    >>> config.get_all()
+    >>> collector.snapshot()['requests']['GET_UID']['count']
+    118
+
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from bisect import bisect_left
+
+log = logging.getLogger(__name__)
+
+RequestStart = namedtuple('RequestStart', ['method', 'endpoint', 'url', 'start'])
+"""A request that is about to be sent: method, endpoint name, url and time.time() of the start"""
+
+RequestEnd = namedtuple('RequestEnd', ['method', 'endpoint', 'url', 'start', 'status', 'bytes_sent',
+                                       'bytes_received', 'duration', 'error'])
+"""A request that is done: method, endpoint name, url, start, status code (None on an error), bytes sent and
+received, duration in seconds and the exception (or None)"""
+
+EVENTS = ('request_start', 'request_end', 'cache_lookup', 'cache_write', 'reauthenticate', 'vpn_login')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Default upper bounds (seconds) of the histogram buckets"""
+
+
+class Instrumentation(object):
+    '''
+    Event bus for the measurements of a server and its cache.
+    '''
+
+    def __init__(self):
+        self.hooks = {}
+        self.active = False
+        """True when at least one hook is registered, the servers only measure when it is set"""
+
+    def on(self, event, handler):
+        '''
+        Registers a hook.
+
+        :param event: name of the event, one of gira.instrument.EVENTS.
+        :param handler: callable that is called with the arguments of the event.
+        :returns: the handler.
+        '''
+        if event not in EVENTS:
+            raise ValueError(f'unknown event {event}, expected one of {EVENTS}')
+
+        self.hooks[event] = self.hooks.get(event, ()) + (handler,)
+        self.active = True
+        return(handler)
+
+    def off(self, event, handler):
+        '''
+        Removes a hook.
+        '''
+        self.hooks[event] = tuple(h for h in self.hooks.get(event, ()) if h != handler)
+        if not self.hooks[event]:
+            del self.hooks[event]
+        self.active = bool(self.hooks)
+
+    def emit(self, event, *args):
+        '''
+        Calls the hooks of an event, a failing hook is logged and does not affect the request.
+        '''
+        for handler in self.hooks.get(event, ()):
+            try:
+                handler(*args)
+            except Exception:
+                log.exception(f'{event} hook {handler} failed')
+
+
+class Histogram(object):
+    '''
+    Cumulative histogram of durations.
+
+    :param buckets: sorted upper bounds of the buckets in seconds.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        '''
+        Adds a value to the histogram.
+        '''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        '''
+        Returns a list of (upper bound, number of values <= upper bound) tuples, the last bound is float('inf').
+        '''
+        total = 0
+        result = []
+        for (bound, count) in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return(result)
+
+    def quantile(self, q):
+        '''
+        Returns the upper bound of the bucket that holds the q (0..1) quantile or None when there are no values.
+        '''
+        if not self.count:
+            return(None)
+
+        rank = q * self.count
+        for (bound, total) in self.cumulative():
+            if total >= rank:
+                return(bound)
+
+
+class HistogramCollector(object):
+    '''
+    In memory collector of request durations per endpoint, status codes, bytes and cache lookups.
+
+    :param buckets: sorted upper bounds of the histogram buckets in seconds.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.instrumentation = []
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all measurements.
+        '''
+        with self.lock:
+            self.requests = {}
+            """dict with per endpoint a gira.instrument.Histogram of the durations"""
+            self.status = {}
+            """dict with per (endpoint, status code) the number of requests"""
+            self.bytes_sent = {}
+            self.bytes_received = {}
+            self.errors = {}
+            """dict with per endpoint the number of requests that failed without a response"""
+            self.cache = Histogram(self.buckets)
+            """gira.instrument.Histogram of the duration of the database lookups of the cache"""
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.cache_writes = 0
+            self.reauthentications = 0
+            self.vpn_logins = 0
+
+    def attach(self, instrumentation):
+        '''
+        Registers the collector on an event bus, a collector can be attached to more than one server.
+
+        :param instrumentation: gira.instrument.Instrumentation object, e.g. server.instrumentation.
+        :returns: the collector itself.
+        '''
+        instrumentation.on('request_end', self.request_end)
+        instrumentation.on('cache_lookup', self.cache_lookup)
+        instrumentation.on('cache_write', self.cache_write)
+        instrumentation.on('reauthenticate', self.reauthenticate)
+        instrumentation.on('vpn_login', self.vpn_login)
+        self.instrumentation.append(instrumentation)
+        return(self)
+
+    def detach(self):
+        '''
+        Removes the collector from all the event buses it was attached to.
+        '''
+        for instrumentation in self.instrumentation:
+            instrumentation.off('request_end', self.request_end)
+            instrumentation.off('cache_lookup', self.cache_lookup)
+            instrumentation.off('cache_write', self.cache_write)
+            instrumentation.off('reauthenticate', self.reauthenticate)
+            instrumentation.off('vpn_login', self.vpn_login)
+        self.instrumentation = []
+
+    def request_end(self, event):
+        endpoint = event.endpoint
+        with self.lock:
+            histogram = self.requests.get(endpoint)
+            if histogram is None:
+                histogram = self.requests[endpoint] = Histogram(self.buckets)
+            histogram.observe(event.duration)
+
+            if event.error is not None:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            else:
+                key = (endpoint, event.status)
+                self.status[key] = self.status.get(key, 0) + 1
+
+            self.bytes_sent[endpoint] = self.bytes_sent.get(endpoint, 0) + event.bytes_sent
+            self.bytes_received[endpoint] = self.bytes_received.get(endpoint, 0) + event.bytes_received
+
+    def cache_lookup(self, key, hit, duration):
+        with self.lock:
+            self.cache.observe(duration)
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def cache_write(self, key, duration):
+        with self.lock:
+            self.cache.observe(duration)
+            self.cache_writes += 1
+
+    def reauthenticate(self, token):
+        with self.lock:
+            self.reauthentications += 1
+
+    def vpn_login(self, success, duration):
+        with self.lock:
+            self.vpn_logins += 1
+
+    def snapshot(self):
+        '''
+        Returns the measurements as plain data.
+
+        :returns: dict with 'requests' (per endpoint count, sum, buckets, p50, p99, status, errors and bytes),
+            'cache' (hits, misses, writes, count, sum and buckets of the database round trips) and the counters
+            'reauthentications' and 'vpn_logins'.
+        '''
+        with self.lock:
+            requests = {}
+            for (endpoint, histogram) in self.requests.items():
+                requests[endpoint] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': histogram.cumulative(),
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                    'status': {status: n for ((e, status), n) in self.status.items() if e == endpoint},
+                    'errors': self.errors.get(endpoint, 0),
+                    'bytes_sent': self.bytes_sent.get(endpoint, 0),
+                    'bytes_received': self.bytes_received.get(endpoint, 0),
+                    }
+
+            return({
+                'requests': requests,
+                'cache': {
+                    'hits': self.cache_hits,
+                    'misses': self.cache_misses,
+                    'writes': self.cache_writes,
+                    'count': self.cache.count,
+                    'sum': self.cache.sum,
+                    'buckets': self.cache.cumulative(),
+                    },
+                'reauthentications': self.reauthentications,
+                'vpn_logins': self.vpn_logins,
+                })
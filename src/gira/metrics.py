@@ -0,0 +1,251 @@
+"""Module to export the statistics of the library in the Prometheus text format.
+
+The :class:`MetricsExporter` collects the request latency per endpoint (through the hooks of
+:mod:`gira.instrument`), the re-authentications and VPN logins, the database round trips of the cache, the events
+received by a :class:`gira.callback.CallbackServer` and the depth of its queue, and the number of datapoints whose
+value was not updated for a while. :meth:`MetricsExporter.render` returns the text exposition format, it can be
+served from a thread with :meth:`MetricsExporter.serve` or added to an aiohttp application with
+:meth:`MetricsExporter.handle`.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.metrics import MetricsExporter
+    >>> exporter = MetricsExporter(stale_after=3600)
+    >>> exporter.add_server(server, site='home')
+    >>> exporter.add_config(config, site='home')
+    >>> exporter.add_callback_server(receiver)
+    >>> exporter.serve(port=9464)
+    >>> print(exporter.render())
+    # HELP gira_request_duration_seconds Duration of the requests to the device.
+    # TYPE gira_request_duration_seconds histogram
+    gira_request_duration_seconds_bucket{site="home",endpoint="GET_UID",le="0.005"} 112
+    ...
+
+Or with the callback receiver: ``receiver.app.router.add_get('/metrics', exporter.handle)``.
+
+"""
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gira.instrument import HistogramCollector
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsExporter(object):
+    '''
+    Prometheus exporter for one or more servers, device configurations and callback receivers.
+
+    :param stale_after: seconds after which a datapoint without a value update counts as stale.
+    :param namespace: prefix of the metric names.
+    '''
+
+    def __init__(self, stale_after=3600, namespace='gira'):
+        self.stale_after = stale_after
+        self.namespace = namespace
+        self.servers = {}
+        """dict with per site a (server, gira.instrument.HistogramCollector) tuple"""
+        self.configs = {}
+        self.callbacks = {}
+        self.httpd = None
+        self._previous = {}
+
+    def add_server(self, server, site=None):
+        '''
+        Measures the requests of a GiraServer or AsyncGiraServer.
+
+        :param server: gira.device.GiraServer or gira.aio.AsyncGiraServer object.
+        :param site: value of the site label, defaults to the instance name of the cache.
+        '''
+        site = site or server.cache.instance
+        collector = HistogramCollector().attach(server.instrumentation)
+        if server.cache.instrumentation is not None and server.cache.instrumentation is not server.instrumentation:
+            collector.attach(server.cache.instrumentation)
+        self.servers[site] = (server, collector)
+
+    def add_config(self, config, site=None):
+        '''
+        Counts the (stale) datapoints of a device configuration.
+
+        :param config: gira.device.DeviceConfig object
+        :param site: value of the site label, defaults to the instance name of the cache.
+        '''
+        self.configs[site or config.cache.instance] = config
+
+    def add_callback_server(self, receiver, name='callback'):
+        '''
+        Reports the events and the queue of a callback receiver.
+
+        :param receiver: gira.callback.CallbackServer object
+        :param name: value of the receiver label.
+        '''
+        self.callbacks[name] = receiver
+
+    def remove(self, site):
+        '''
+        Stops reporting the server and configuration of a site.
+        '''
+        (server, collector) = self.servers.pop(site, (None, None))
+        if collector:
+            collector.detach()
+        self.configs.pop(site, None)
+
+    def render(self):
+        '''
+        Returns all metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        name = self.namespace
+
+        snapshots = {site: (server, collector.snapshot()) for (site, (server, collector)) in self.servers.items()}
+
+        _histogram(lines, f'{name}_request_duration_seconds', 'Duration of the requests to the device.',
+                   [({'site': site, 'endpoint': endpoint}, requests)
+                    for (site, (server, snapshot)) in snapshots.items()
+                    for (endpoint, requests) in snapshot['requests'].items()])
+        _metric(lines, f'{name}_requests_total', 'counter', 'Requests to the device by status code.',
+                [({'site': site, 'endpoint': endpoint, 'status': status}, count)
+                 for (site, (server, snapshot)) in snapshots.items()
+                 for (endpoint, requests) in snapshot['requests'].items()
+                 for (status, count) in requests['status'].items()])
+        _metric(lines, f'{name}_request_errors_total', 'counter', 'Requests that failed without a response.',
+                [({'site': site, 'endpoint': endpoint}, requests['errors'])
+                 for (site, (server, snapshot)) in snapshots.items()
+                 for (endpoint, requests) in snapshot['requests'].items()])
+        _metric(lines, f'{name}_request_sent_bytes_total', 'counter', 'Bytes sent in request bodies.',
+                [({'site': site, 'endpoint': endpoint}, requests['bytes_sent'])
+                 for (site, (server, snapshot)) in snapshots.items()
+                 for (endpoint, requests) in snapshot['requests'].items()])
+        _metric(lines, f'{name}_request_received_bytes_total', 'counter', 'Bytes received in response bodies.',
+                [({'site': site, 'endpoint': endpoint}, requests['bytes_received'])
+                 for (site, (server, snapshot)) in snapshots.items()
+                 for (endpoint, requests) in snapshot['requests'].items()])
+
+        _metric(lines, f'{name}_reauthentications_total', 'counter', 'Tokens renewed after the device refused them.',
+                [({'site': site}, server.reauthentications) for (site, (server, snapshot)) in snapshots.items()])
+        _metric(lines, f'{name}_vpn_logins_total', 'counter', 'Logins on the VPN portal.',
+                [({'site': site}, snapshot['vpn_logins']) for (site, (server, snapshot)) in snapshots.items()])
+
+        _metric(lines, f'{name}_cache_round_trips_total', 'counter', 'Queries sent to the cache database.',
+                [({'site': site}, server.cache.round_trips) for (site, (server, snapshot)) in snapshots.items()])
+        _metric(lines, f'{name}_cache_hits_total', 'counter', 'Cache variables found in the database.',
+                [({'site': site}, server.cache.hits) for (site, (server, snapshot)) in snapshots.items()])
+        _metric(lines, f'{name}_cache_misses_total', 'counter', 'Cache variables not found in the database.',
+                [({'site': site}, server.cache.misses) for (site, (server, snapshot)) in snapshots.items()])
+
+        now = time.monotonic()
+        rates = []
+        for (receiver_name, receiver) in self.callbacks.items():
+            (previous_time, previous_count) = self._previous.get(receiver_name, (None, None))
+            if previous_time is not None and now > previous_time:
+                rates.append(({'receiver': receiver_name},
+                              (receiver.events_received - previous_count) / (now - previous_time)))
+            self._previous[receiver_name] = (now, receiver.events_received)
+
+        _metric(lines, f'{name}_callback_events_total', 'counter', 'Events received from the device.',
+                [({'receiver': n}, r.events_received) for (n, r) in self.callbacks.items()])
+        _metric(lines, f'{name}_callback_events_per_second', 'gauge', 'Events received per second since the previous scrape.',
+                rates)
+        _metric(lines, f'{name}_callback_events_unknown_total', 'counter', 'Events for a uid that is not configured.',
+                [({'receiver': n}, r.events_unknown) for (n, r) in self.callbacks.items()])
+        _metric(lines, f'{name}_callback_batches_refused_total', 'counter', 'Callbacks refused because the queue was full.',
+                [({'receiver': n}, r.batches_refused) for (n, r) in self.callbacks.items()])
+        _metric(lines, f'{name}_callback_queue_depth', 'gauge', 'Events waiting in the queue.',
+                [({'receiver': n}, r.queue.qsize()) for (n, r) in self.callbacks.items()])
+        _metric(lines, f'{name}_callback_queue_size', 'gauge', 'Maximum number of events in the queue.',
+                [({'receiver': n}, r.queue.maxsize) for (n, r) in self.callbacks.items()])
+
+        _metric(lines, f'{name}_datapoints', 'gauge', 'Datapoints in the device configuration.',
+                [({'site': site}, len(config.dataPiont_uids)) for (site, config) in self.configs.items()])
+        _metric(lines, f'{name}_datapoints_stale', 'gauge',
+                f'Datapoints without a value update in the last {self.stale_after} seconds.',
+                [({'site': site}, len(config.stale(self.stale_after))) for (site, config) in self.configs.items()])
+
+        return('\n'.join(lines) + '\n')
+
+    async def handle(self, request):
+        '''
+        aiohttp request handler that returns the metrics.
+        '''
+        from aiohttp import web
+        return(web.Response(body=self.render().encode(), headers={'Content-Type': CONTENT_TYPE}))
+
+    def serve(self, host='0.0.0.0', port=9464, path='/metrics'):
+        '''
+        Serves the metrics over http from a background thread until :meth:`MetricsExporter.stop` is called.
+
+        :param host: address to listen on.
+        :param port: port to listen on.
+        :param path: url path of the metrics.
+        :returns: http.server.ThreadingHTTPServer object
+        '''
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != path:
+                    self.send_error(404)
+                    return
+
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(format % args)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name='gira-metrics', daemon=True).start()
+        log.info(f'serving metrics on {host}:{self.httpd.server_port}{path}')
+        return(self.httpd)
+
+    def stop(self):
+        '''
+        Stops serving the metrics.
+        '''
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+def _labels(labels):
+    return(','.join(f'{k}="{_escape(v)}"' for (k, v) in labels.items()))
+
+
+def _escape(value):
+    return(str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+
+
+def _value(value):
+    if value == float('inf'):
+        return('+Inf')
+    return(repr(float(value)) if isinstance(value, float) else str(value))
+
+
+def _metric(lines, name, kind, description, samples):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f'# TYPE {name} {kind}')
+    for (labels, value) in samples:
+        lines.append(f'{name}{{{_labels(labels)}}} {_value(value)}')
+
+
+def _histogram(lines, name, description, samples):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f'# TYPE {name} histogram')
+    for (labels, histogram) in samples:
+        for (bound, count) in histogram['buckets']:
+            lines.append(f'{name}_bucket{{{_labels(dict(labels, le=_value(bound)))}}} {count}')
+        lines.append(f'{name}_sum{{{_labels(labels)}}} {_value(histogram["sum"])}')
+        lines.append(f'{name}_count{{{_labels(labels)}}} {histogram["count"]}')
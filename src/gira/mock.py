@@ -0,0 +1,452 @@
+"""Module with a local stand-in for an X1/Homeserver to test and benchmark against.
+
+The :class:`MockGiraServer` implements the endpoints of :data:`gira.device.DeviceTypes` (identity, clients,
+uiconfig, uid, values and callbacks) on top of a uiconfig, e.g. GiraDocumentation/exmaple_config.json of the
+repository or one created with :func:`generate_config`. It listens on https with a self-signed certificate (generated with the cryptography package) like the real device.
+Every request can be delayed and a share of the requests can be answered with an error, tokens can be made to
+expire to exercise the re-authentication.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.mock import MockGiraServer
+    >>> with MockGiraServer('GiraDocumentation/exmaple_config.json', latency=(0.005, 0.02), error_rate=0.01) as mock:
+    ...     server = GiraServer(mock.hostname, 'admin', 'admin', cache)
+    ...     config = server.get_device_config()
+
+Or on a running event loop with ``await mock.start()`` and ``await mock.stop()``. Values that are put are posted
+as events to the registered value callback, as the device does.
+
+For scaling tests :func:`generate_config` creates a uiconfig of any size with the function types of the example
+configuration, a nested location tree and trades.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> from gira.mock import generate_config
+    >>> config = generate_config(functions=5000, location_depth=4, locations_per_level=5, trades=20)
+    >>> mock = MockGiraServer(config)
+
+"""
+
+import logging
+import os
+import json
+import time
+import random
+import uuid
+import ssl
+import base64
+import asyncio
+import datetime
+import tempfile
+import threading
+
+from aiohttp import web
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+FunctionTypes = {
+    'de.gira.schema.functions.KNX.Light': ('de.gira.schema.channels.KNX.Dimmer', ('OnOff', 'Shift', 'Brightness'), 'Lighting'),
+    'de.gira.schema.functions.Switch': ('de.gira.schema.channels.Switch', ('OnOff',), 'Lighting'),
+    'de.gira.schema.functions.Covering': ('de.gira.schema.channels.BlindWithPos', ('Step-Up-Down', 'Up-Down'), 'Shading'),
+    'de.gira.schema.functions.KNX.HeatingCooling': ('de.gira.schema.channels.KNX.HeatingCoolingSwitchable',
+                                                    ('Current', 'Set-Point', 'Mode', 'Status', 'Heating'), 'Climate'),
+    'de.gira.schema.functions.Scene': ('de.gira.schema.channels.SceneControl', ('Scene',), 'Scenes'),
+    'de.gira.schema.functions.Trigger': ('de.gira.schema.channels.Trigger', ('Trigger',), 'Other'),
+    'de.gira.schema.functions.PercentValue': ('de.gira.schema.channels.Percent', ('Percent',), 'Other'),
+    'de.gira.schema.functions.NumericUnsignedStatus': ('de.gira.schema.channels.DWord', ('DWord',), 'Metering'),
+    'de.gira.schema.functions.BinaryStatus': ('de.gira.schema.channels.Binary', ('Binary',), 'Security'),
+    }
+"""functionType: (channelType, datapoint names, tradeType) of the functions that generate_config creates"""
+
+_LocationTypes = ('Building', 'Floor', 'Room', 'Zone', 'Area')
+
+
+class MockGiraServer(object):
+    '''
+    aiohttp based stand-in for an X1/Homeserver.
+
+    :param config: uiconfig (dict) or the path of a uiconfig json file.
+    :param username: username of the device.
+    :param password: password of the device.
+    :param latency: seconds every request is delayed, or a (minimum, maximum) tuple for a random delay.
+    :param error_rate: share (0..1) of the requests that are answered with error_status.
+    :param error_status: status code of the injected errors.
+    :param token_lifetime: seconds after which a token is refused with 401, None for tokens that never expire.
+    :param use_ssl: boolean if True the server listens on https with a self-signed certificate.
+    :param device_type: device type reported by the identity endpoint.
+    '''
+
+    def __init__(self, config, username='admin', password='admin', latency=0, error_rate=0.0,
+                 error_status=500, token_lifetime=None, use_ssl=True, device_type='GIGSRVKX02'):
+
+        if isinstance(config, str):
+            with open(config) as f:
+                config = json.load(f)
+
+        self.config = config
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_lifetime = token_lifetime
+        self.use_ssl = use_ssl
+        self.device_type = device_type
+
+        self.functions = {f['uid']: [dp['uid'] for dp in f.get('dataPoints', [])] for f in config.get('functions', [])}
+        self.values = {uid: '0' for uids in self.functions.values() for uid in uids}
+        """dict with the current value of every datapoint"""
+        self.tokens = {}
+        """dict with per token the time.time() it was issued"""
+        self.callbacks = {}
+        """dict with per token the registered (serviceCallback, valueCallback)"""
+        self.requests = {}
+        """dict with per route the number of requests received"""
+        self.errors_injected = 0
+
+        self.host = None
+        self.port = None
+        self.runner = None
+        self.client = None
+        self._loop = None
+        self._thread = None
+
+        self.app = web.Application(middlewares=[self._inject])
+        self.app.router.add_get('/api/v2', self.handle_identity)
+        self.app.router.add_post('/api/v2/clients', self.handle_register)
+        self.app.router.add_delete('/api/clients/{token}', self.handle_unregister)
+        self.app.router.add_post('/api/clients/{token}/callbacks', self.handle_set_callbacks)
+        self.app.router.add_delete('/api/clients/{token}/callbacks', self.handle_delete_callbacks)
+        self.app.router.add_get('/api/v2/uiconfig', self.handle_uiconfig)
+        self.app.router.add_get('/api/uiconfig/uid', self.handle_uid)
+        self.app.router.add_get('/api/v2/values/{uid}', self.handle_get_value)
+        self.app.router.add_put('/api/v2/values', self.handle_put_values)
+
+    @property
+    def hostname(self):
+        '''
+        host:port to pass as hostname to GiraServer.
+        '''
+        return(f'{self.host}:{self.port}')
+
+    def __enter__(self):
+        self.start_in_thread()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_in_thread()
+
+    async def start(self, host='127.0.0.1', port=0):
+        '''
+        Starts listening on the running event loop.
+
+        :param host: address to listen on.
+        :param port: port to listen on, 0 picks a free port.
+        '''
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port, ssl_context=_self_signed(host) if self.use_ssl else None)
+        await site.start()
+        (self.host, self.port) = self.runner.addresses[0][:2]
+        self.client = aiohttp.ClientSession()
+        log.info(f'mock {self.device_type} listening on {self.hostname}')
+
+    async def stop(self):
+        '''
+        Stops listening.
+        '''
+        if self.client:
+            await self.client.close()
+            self.client = None
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def start_in_thread(self, host='127.0.0.1', port=0):
+        '''
+        Starts the server on its own event loop in a background thread, for synchronous clients.
+
+        :returns: the server itself.
+        '''
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start(host, port))
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='gira-mock', daemon=True)
+        self._thread.start()
+        started.wait()
+        return(self)
+
+    def stop_in_thread(self):
+        '''
+        Stops the server started with start_in_thread.
+        '''
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def expire_tokens(self):
+        '''
+        Makes the device refuse all the tokens it issued, the clients have to authenticate again.
+        '''
+        self.tokens.clear()
+
+    async def send_events(self, events, token=None):
+        '''
+        Posts events to the value callbacks, like the device does for changes on the KNX bus.
+
+        :param events: list of {'uid': uid, 'value': value} dicts.
+        :param token: only post to the callback of this token, defaults to all registered callbacks.
+        :returns: list of the status codes of the callbacks.
+        '''
+        statuses = []
+        for (client_token, (service_url, value_url)) in list(self.callbacks.items()):
+            if token and client_token != token:
+                continue
+            body = {'token': client_token, 'events': events, 'failures': 0}
+            async with self.client.post(value_url, json=body, ssl=False) as r:
+                statuses.append(r.status)
+        return(statuses)
+
+    @web.middleware
+    async def _inject(self, request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        key = f'{request.method} {route}'
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        if self.latency:
+            delay = random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+            await asyncio.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors_injected += 1
+            return(_error(self.error_status, 'internalError', 'injected error'))
+
+        return(await handler(request))
+
+    def _valid(self, token):
+        issued = self.tokens.get(token)
+        if issued is None:
+            return(False)
+        return(self.token_lifetime is None or time.time() - issued < self.token_lifetime)
+
+    def _token(self, request):
+        token = request.match_info.get('token') or request.query.get('token')
+        if not self._valid(token):
+            raise web.HTTPUnauthorized(body=_error_body('invalidToken', 'token is not valid'),
+                                       content_type='application/json')
+        return(token)
+
+    async def handle_identity(self, request):
+        return(_json({'deviceName': 'Mock', 'deviceType': self.device_type, 'deviceVersion': '4.7.0',
+                                  'info': 'GDS-REST-API', 'version': '2'}))
+
+    async def handle_register(self, request):
+        (scheme, _, credentials) = request.headers.get('Authorization', '').partition(' ')
+        try:
+            (username, _, password) = base64.b64decode(credentials).decode().partition(':')
+        except ValueError:
+            (username, password) = (None, None)
+
+        if scheme != 'Basic' or username != self.username or password != self.password:
+            return(_error(401, 'unauthorized', 'invalid username or password'))
+
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.time()
+        return(_json({'token': token}, status=201))
+
+    async def handle_unregister(self, request):
+        token = self._token(request)
+        self.tokens.pop(token, None)
+        self.callbacks.pop(token, None)
+        return(web.Response(status=204))
+
+    async def handle_set_callbacks(self, request):
+        token = self._token(request)
+        body = await request.json()
+        self.callbacks[token] = (body.get('serviceCallback'), body.get('valueCallback'))
+        return(web.Response(status=200))
+
+    async def handle_delete_callbacks(self, request):
+        token = self._token(request)
+        self.callbacks.pop(token, None)
+        return(web.Response(status=200))
+
+    async def handle_uiconfig(self, request):
+        self._token(request)
+        return(_json(self.config))
+
+    async def handle_uid(self, request):
+        self._token(request)
+        return(_json({'uid': self.config.get('uid')}))
+
+    async def handle_get_value(self, request):
+        self._token(request)
+        uid = request.match_info['uid']
+        if uid in self.functions:
+            uids = self.functions[uid]
+        elif uid in self.values:
+            uids = [uid]
+        else:
+            return(_error(404, 'uidNotFound', f'uid {uid} not found'))
+        return(_json({'values': [{'uid': u, 'value': self.values[u]} for u in uids]}))
+
+    async def handle_put_values(self, request):
+        self._token(request)
+        events = []
+        for item in (await request.json()).get('values', []):
+            if item['uid'] not in self.values:
+                return(_error(404, 'uidNotFound', f'uid {item["uid"]} not found'))
+            self.values[item['uid']] = str(item['value'])
+            events.append({'uid': item['uid'], 'value': str(item['value'])})
+
+        if events and self.callbacks:
+            task = asyncio.get_running_loop().create_task(self.send_events(events))
+            task.add_done_callback(_log_failure)
+        return(web.Response(status=200))
+
+
+def generate_config(functions=1000, datapoints_per_function=None, location_depth=3, locations_per_level=4, trades=14,
+                    parameters=5, seed=0):
+    '''
+    Generates a uiconfig with the structure of the configuration of a real device.
+
+    :param functions: number of functions.
+    :param datapoints_per_function: number of datapoints of every function, by default the datapoints of its
+        function type (1 to 5, on average about 2).
+    :param location_depth: number of levels of the location tree (building, floor, room, ...).
+    :param locations_per_level: number of child locations of every location.
+    :param trades: number of trades, the functions are spread over the trades of their trade type.
+    :param parameters: number of parameters of every function.
+    :param seed: seed of the random generator, the same arguments and seed give the same configuration.
+    :returns: uiconfig (dict)
+    '''
+    rand = random.Random(seed)
+    types = list(FunctionTypes)
+    counter = iter(range(1, 1 << 62))
+
+    def uid():
+        return('a' + _base36(next(counter)).rjust(3, '0'))
+
+    config_functions = []
+    for n in range(functions):
+        function_type = rand.choice(types)
+        (channel_type, names, trade_type) = FunctionTypes[function_type]
+        if datapoints_per_function is not None:
+            names = [names[i % len(names)] + (str(i // len(names)) if i >= len(names) else '')
+                     for i in range(datapoints_per_function)]
+
+        function_uid = uid()
+        config_functions.append({
+            'channelType': channel_type,
+            'dataPoints': [{'canEvent': True, 'canRead': True, 'canWrite': name != 'Current', 'name': name, 'uid': uid()}
+                           for name in names],
+            'displayName': f'{function_type.rsplit(".", 1)[1]} {n}',
+            'functionType': function_type,
+            'parameters': [{'key': f'Parameter{i}', 'set': 'Visu', 'value': str(i)} for i in range(parameters)],
+            'uid': function_uid,
+            })
+
+    # only the leaves of the location tree hold functions
+    leaves = []
+
+    def location(level, name):
+        config = {'displayName': name, 'locationType': _LocationTypes[min(level, len(_LocationTypes) - 1)]}
+        if level + 1 < location_depth:
+            config['locations'] = [location(level + 1, f'{name}.{i}') for i in range(locations_per_level)]
+        else:
+            config['functions'] = []
+            leaves.append(config)
+        return(config)
+
+    locations = [location(0, f'location {i}') for i in range(locations_per_level)] if location_depth else []
+    for (n, function) in enumerate(config_functions):
+        if leaves:
+            leaves[n % len(leaves)]['functions'].append(function['uid'])
+
+    trade_types = sorted(set(trade_type for (channel_type, names, trade_type) in FunctionTypes.values()))
+    config_trades = [{'displayName': f'{trade_types[i % len(trade_types)]} {i}', 'functions': [],
+                      'tradeType': trade_types[i % len(trade_types)]} for i in range(trades)]
+    by_type = {}
+    for trade in config_trades:
+        by_type.setdefault(trade['tradeType'], []).append(trade)
+    for function in config_functions:
+        candidates = by_type.get(FunctionTypes[function['functionType']][2])
+        if candidates:
+            rand.choice(candidates)['functions'].append(function['uid'])
+
+    return({'functions': config_functions, 'locations': locations, 'trades': config_trades, 'uid': uid()})
+
+
+def _base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while n:
+        (n, digit) = divmod(n, 36)
+        result = digits[digit] + result
+    return(result or '0')
+
+
+def _json(data, status=200):
+    # the device sends application/json without a charset
+    return(web.Response(status=status, body=json.dumps(data).encode(), content_type='application/json'))
+
+
+def _error_body(code, message):
+    return(json.dumps({'error': {'code': code, 'message': message}}))
+
+
+def _error(status, code, message):
+    return(web.Response(status=status, body=_error_body(code, message), content_type='application/json'))
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception():
+        log.error(f'sending events failed: {task.exception()!r}')
+
+
+def _self_signed(hostname):
+    '''
+    Returns a server ssl.SSLContext with a freshly generated self-signed certificate.
+    '''
+    try:
+        from cryptography import x509
+        from cryptography.x509.oid import NameOID
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+    except ImportError:
+        raise ImportError('the cryptography package is needed for https, install it or use use_ssl=False')
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder()
+                   .subject_name(name)
+                   .issuer_name(name)
+                   .public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1))
+                   .not_valid_after(now + datetime.timedelta(days=30))
+                   .sign(key, hashes.SHA256()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        (cert_file, key_file) = (os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem'))
+        with open(cert_file, 'wb') as f:
+            f.write(certificate.public_bytes(serialization.Encoding.PEM))
+        with open(key_file, 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert_file, key_file)
+
+    return(context)
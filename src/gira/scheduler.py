@@ -0,0 +1,121 @@
+"""Module to coalesce rapid datapoint writes.
+
+A UI slider can set a `Brightness` datapoint many times per second. Sending every value with its own PUT makes the
+requests queue up and arrive late. The :class:`WriteScheduler` keeps only the latest pending value per uid and
+sends all pending values every interval with one batched :meth:`gira.device.GiraServer.put_uids`.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> server.enable_write_scheduler(interval=0.05)
+    >>> for brightness in range(100):
+    ...     future = config.uid('a004').set(brightness)
+    >>> future.result()
+    True
+
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class WriteScheduler(object):
+    '''
+    Collects writes and sends them in batches from a background thread.
+
+    Every scheduled write returns a concurrent.futures.Future that resolves with True or False when the batch with
+    the value was sent. A write that is replaced by a newer value for the same uid before it was sent is never
+    sent, its future resolves with the outcome of the newer value.
+
+    :param server: gira.device.GiraServer object
+    :param interval: seconds between the first pending write and sending the batch.
+    '''
+
+    def __init__(self, server, interval=0.05):
+        self.server = server
+        self.interval = interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='gira-write-scheduler', daemon=True)
+        self.thread.start()
+
+    def schedule(self, uid, value):
+        '''
+        Schedules a write, replacing a pending write for the same uid.
+
+        :param uid: uid from the data point.
+        :param value: data point value to be set
+        :returns: concurrent.futures.Future with the result (True of False) of the put.
+        '''
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('write scheduler is closed')
+
+            entry = self.pending.get(uid)
+            if entry:
+                entry[0] = value
+                entry[1].append(future)
+            else:
+                self.pending[uid] = [value, [future]]
+            self.wakeup.set()
+
+        return(future)
+
+    def flush(self):
+        '''
+        Sends all pending writes now.
+
+        :returns: True if all values were accepted by the device, False otherwise.
+        '''
+        with self.lock:
+            (pending, self.pending) = (self.pending, {})
+            if not self.closed:
+                self.wakeup.clear()
+
+        if not pending:
+            return(True)
+
+        values = {uid: entry[0] for (uid, entry) in pending.items()}
+        log.debug(f'sending {len(values)} coalesced writes')
+
+        try:
+            result = self.server.put_uids(values)
+        except Exception as e:
+            log.error(f'sending {len(values)} writes failed: {e!r}')
+            for (value, futures) in pending.values():
+                for future in futures:
+                    future.set_exception(e)
+            return(False)
+
+        for (value, futures) in pending.values():
+            for future in futures:
+                future.set_result(result)
+
+        return(result)
+
+    def close(self):
+        '''
+        Sends the pending writes and stops the background thread.
+        '''
+        with self.lock:
+            self.closed = True
+            self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            if self.closed:
+                return
+            time.sleep(self.interval)
+            if self.closed:
+                return
+            self.flush()
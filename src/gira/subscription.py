@@ -0,0 +1,131 @@
+"""Module to dispatch datapoint value changes to subscribers.
+
+A :class:`Subscription` is created by the subscribe methods of :class:`gira.device.DeviceConfig`,
+:class:`gira.device.Function` and :class:`gira.device.Datapoint`. The handler is called with a :data:`ValueChange`
+every time the value of one of the subscribed datapoints changes, assigning the same value again is not a change.
+
+.. highlight:: python
+.. code-block:: python
+
+    >>> def changed(change):
+    ...     print(change.uid, change.old, change.new)
+    >>> subscription = config.subscribe(changed, name='Brightness', within='Begane grond (Floor)', coalesce=0.2)
+    >>> subscription.cancel()
+
+Handlers can be plain functions or coroutine functions. A plain function is called in the thread that changed the
+value, a coroutine function is scheduled on the event loop that was running when it subscribed (or the loop that
+was passed). With coalesce the changes of a datapoint are collected for that many seconds and only the last value is
+dispatched, so a dimmer ramp results in one call instead of one per step.
+
+"""
+
+import logging
+import inspect
+import threading
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+ValueChange = namedtuple('ValueChange', ['uid', 'old', 'new', 'datapoint'])
+"""A value change of a datapoint: uid, old value, new value and the gira.device.Datapoint"""
+
+
+class Subscription(object):
+    '''
+    Subscription of a handler to the value changes of one or more datapoints.
+
+    :param handler: callable or coroutine function that receives a ValueChange.
+    :param coalesce: seconds to collect changes of a datapoint before only the last one is dispatched.
+    :param loop: event loop for a coroutine function handler, defaults to the running loop.
+    '''
+
+    def __init__(self, handler, coalesce=None, loop=None):
+        self.handler = handler
+        self.coalesce = coalesce
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.datapoints = []
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        if self.is_async and loop is None:
+            # a coroutine function handler implies asyncio is in use, it is not imported for the other handlers
+            import asyncio
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                raise ValueError('a coroutine function handler needs a running event loop or the loop parameter')
+        self.loop = loop
+
+    def attach(self, datapoints):
+        '''
+        Subscribes to the value changes of the datapoints.
+
+        :param datapoints: iterable of gira.device.Datapoint objects.
+        :returns: the subscription itself.
+        '''
+        for dp in datapoints:
+            dp._subscribe(self)
+            self.datapoints.append(dp)
+        return(self)
+
+    def cancel(self):
+        '''
+        Unsubscribes from all datapoints, pending coalesced changes are dropped.
+        '''
+        for dp in self.datapoints:
+            dp._unsubscribe(self)
+        self.datapoints = []
+        with self.lock:
+            self.pending.clear()
+
+    def notify(self, datapoint, old, new):
+        '''
+        Is called by the datapoint when its value changed.
+        '''
+        if not self.coalesce:
+            return(self._dispatch(ValueChange(datapoint.uid, old, new, datapoint)))
+
+        with self.lock:
+            if datapoint.uid in self.pending:
+                self.pending[datapoint.uid][2] = new
+                return(None)
+
+            self.pending[datapoint.uid] = [datapoint, old, new]
+            first = len(self.pending) == 1
+
+        if first:
+            if self.is_async:
+                self.loop.call_soon_threadsafe(self.loop.call_later, self.coalesce, self._flush)
+            else:
+                timer = threading.Timer(self.coalesce, self._flush)
+                timer.daemon = True
+                timer.start()
+        return(None)
+
+    def _flush(self):
+        with self.lock:
+            (pending, self.pending) = (self.pending, {})
+
+        for (datapoint, old, new) in pending.values():
+            # a value that went back to where it started within the window is not a change
+            if old != new:
+                self._dispatch(ValueChange(datapoint.uid, old, new, datapoint))
+
+    def _dispatch(self, change):
+        if self.is_async:
+            self.loop.call_soon_threadsafe(self._create_task, change)
+            return(None)
+
+        try:
+            self.handler(change)
+        except Exception:
+            log.exception(f'handler {self.handler} failed on {change.uid}')
+
+    def _create_task(self, change):
+        task = self.loop.create_task(self.handler(change))
+        task.add_done_callback(_log_failure)
+
+
+def _log_failure(task):
+    if not task.cancelled() and task.exception():
+        log.error(f'handler failed: {task.exception()!r}')
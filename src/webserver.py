@@ -7,6 +7,9 @@ To start this flask test server
   
 You will have to run GiraServer.set_callaback after the server has started.
 
+This flask server handles one request at a time and is meant as a demonstration, use gira.callback.CallbackServer 
+to receive the callbacks in production.
+
 '''
 
 import logging, sys
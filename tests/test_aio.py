@@ -0,0 +1,25 @@
+import asyncio
+
+import gira
+from gira.aio import AsyncGiraServer
+from gira.mock import MockGiraServer
+
+EXAMPLE_CONFIG = 'GiraDocumentation/exmaple_config.json'
+
+
+def test_connect_refresh(request):
+    config = request.config.rootpath / EXAMPLE_CONFIG
+
+    async def connect(hostname):
+        cache = gira.CacheObject(dburi='sqlite://', instance='test_connect_refresh')
+        async with AsyncGiraServer(hostname, 'admin', 'admin', cache) as server:
+            first = await server.connect()
+            cached = await server.connect()
+            refreshed = await server.connect(refresh=True)
+        return(first, cached, refreshed)
+
+    with MockGiraServer(str(config)) as mock:
+        (first, cached, refreshed) = asyncio.run(connect(mock.hostname))
+
+    assert first and cached == first
+    assert refreshed and refreshed != first
@@ -0,0 +1,12 @@
+from gira.cache import CacheObject
+
+
+def test_in_memory_database_with_other_engine_options():
+    first = CacheObject(dburi='sqlite://', instance='a')
+    second = CacheObject(dburi='sqlite://', instance='b', future=False)
+
+    first.token = 'token-a'
+    second.token = 'token-b'
+
+    assert first.token == 'token-a'
+    assert second.token == 'token-b'
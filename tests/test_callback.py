@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from gira.callback import CallbackServer
+from gira.device import DeviceConfig
+from gira.mock import generate_config
+
+
+def post(receiver, *requests):
+    # status codes of the (path, data) requests
+    async def send():
+        async with TestClient(TestServer(receiver.app)) as client:
+            return([(await client.post(path, data=data)).status for (path, data) in requests])
+    return(asyncio.run(send()))
+
+
+def test_value_callback_with_a_function_uid():
+    config = DeviceConfig(cache=None, device=None, device_config=generate_config(functions=3))
+    receiver = CallbackServer()
+    receiver.add(config, token='token')
+    function = next(iter(config.function_uids.values()))
+    dp = function.dataPoints[0]
+
+    events = [{'uid': function.uid, 'value': '1'}, {'uid': dp.uid, 'value': '1'}]
+    assert post(receiver, ('/giraapi/value', json.dumps({'token': 'token', 'events': events}))) == [200]
+    assert dp.value == '1'
+    assert receiver.events_received == 2
+    assert receiver.events_unknown == 1
+
+
+def test_callback_with_invalid_json():
+    receiver = CallbackServer()
+    assert post(receiver, ('/giraapi/value', b'{"events": ['), ('/giraapi/function', b'not json')) == [400, 400]
@@ -0,0 +1,58 @@
+import gc
+
+import pytest
+
+from gira.device import DeviceConfig, _PausedGC
+from gira.mock import generate_config
+
+
+def test_snapshot_restores_the_object_graph():
+    config = DeviceConfig(cache=None, device=None, device_config=generate_config(functions=200, trades=5))
+    restored = DeviceConfig.from_snapshot(config.snapshot(), None, 'device')
+
+    assert list(restored.uids) == list(config.uids)
+    for (uid, function) in config.function_uids.items():
+        copy = restored.function_uids[uid]
+        assert (copy.displayName, copy.functionType, copy.device) == (function.displayName, function.functionType,
+                                                                       'device')
+        assert copy.location.path == function.location.path
+        assert copy.location.uids[uid] is copy
+        if function.trade:
+            assert copy.trade.tradeName == function.trade.tradeName
+            assert copy.trade.uids[uid] is copy
+        else:
+            assert copy.trade is None
+        assert all(dp.function is copy for dp in copy.dataPoints)
+        assert [dp.uid for dp in copy.dataPoints] == [dp.uid for dp in function.dataPoints]
+
+    assert [[child.id for child in location.children] for location in restored.location_ids] == \
+           [[child.id for child in location.children] for location in config.location_ids]
+    assert [location.id for location in restored.locations] == [location.id for location in config.locations]
+    assert restored.functions_within == config.functions_within
+    assert restored.select(name='OnOff') == config.select(name='OnOff')
+
+
+def test_overlapping_paused_gc():
+    # as two threads that build a configuration at the same time
+    (first, second) = (_PausedGC(), _PausedGC())
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert not gc.isenabled()
+    second.__exit__(None, None, None)
+    assert gc.isenabled()
+
+
+def test_sibling_locations_with_the_same_path():
+    config = generate_config(functions=20, location_depth=2, locations_per_level=2, trades=2)
+    building = config['locations'][0]
+    (first, second) = building['locations']
+    second['displayName'] = first['displayName']
+    config = DeviceConfig(cache=None, device=None, device_config=config)
+
+    path = config.location_ids[0].children[0].path
+    assert len(config.location_ids_by_path[path]) == 2
+    assert config.select(location=path) == set(first['functions']) | set(second['functions'])
+    with pytest.raises(ValueError):
+        config.location(path)
+    assert config.location(config.location_ids[0].path) is config.location_ids[0]
@@ -0,0 +1,20 @@
+import pytest
+
+from gira.fleet import GiraFleet
+
+
+def test_add_site_requires_a_database(tmp_path):
+    fleet = GiraFleet(max_workers=2)
+
+    with pytest.raises(TypeError):
+        fleet.add_site('site-a', 'localhost', 'admin', 'admin')
+
+    first = fleet.add_site('site-a', 'localhost', 'admin', 'admin', dburi=f'sqlite:///{tmp_path}/a.db')
+    second = fleet.add_site('site-b', 'localhost', 'admin', 'admin', dburi=f'sqlite:///{tmp_path}/b.db')
+
+    first.cache.token = 'token-a'
+    second.cache.token = 'token-b'
+
+    assert first.cache.token == 'token-a'
+    assert second.cache.token == 'token-b'
+    assert sorted(fleet.servers) == ['site-a', 'site-b']
@@ -0,0 +1,29 @@
+from gira.history import EventLog
+
+LONG_UID = 'a-very-long-datapoint-uid'
+
+
+def test_wraparound_with_a_long_uid(tmp_path):
+    with EventLog(str(tmp_path / 'events'), capacity=3) as history:
+        for i in range(8):
+            history.append(LONG_UID, i, timestamp=1000 + i)
+
+        records = history.query(LONG_UID)
+        assert [value for (timestamp, uid, value) in records] == ['5', '6', '7']
+        assert [timestamp for (timestamp, uid, value) in records] == [1005, 1006, 1007]
+        assert history.last(LONG_UID)[2] == '7'
+        assert sum(len(sequences) - history._stale.get(uid, 0) for (uid, sequences) in history.index.items()) == 3
+
+
+def test_wraparound_with_mixed_uids(tmp_path):
+    path = str(tmp_path / 'events')
+    with EventLog(path, capacity=4) as history:
+        for i in range(10):
+            history.append(LONG_UID if i % 2 else 'a00h', i, timestamp=1000 + i)
+
+        assert [r[2] for r in history.query(LONG_UID)] == ['7', '9']
+        assert [r[2] for r in history.query('a00h', start=1007)] == ['8']
+
+    with EventLog(path) as history:
+        assert [r[2] for r in history.query(LONG_UID)] == ['7', '9']
+        assert [r[2] for r in history.query('a00h')] == ['6', '8']